@@ -0,0 +1,163 @@
+import os
+import random
+from pathlib import Path
+
+
+TEXT_LINES = [
+    "import os",
+    "def main():",
+    "    return compute(x, y)",
+    "x = 1",
+    "# Helper for the data loader",
+    "# TODO: handle the empty case",
+    "# y = x + 1",
+    "    print(result)",
+    "class Model(object):",
+    "",
+]
+
+
+def text_content(rng: random.Random, size: int):
+    """Code-like text of about size bytes, with some todo tags and commented code"""
+    lines, length = [], 0
+    while length < size:
+        line = rng.choice(TEXT_LINES)
+        lines.append(line)
+        length += len(line) + 1
+    return ("\n".join(lines) + "\n").encode()
+
+
+def binary_content(rng: random.Random, size: int):
+    return rng.getrandbits(8 * size).to_bytes(size, 'little') if size else b""
+
+
+def file_paths(files: int, depth: int, fanout: int=8):
+    """Relative paths of files spread over a directory tree of the given depth"""
+    paths = []
+    for i in range(files):
+        parts = [f"dir{(i // fanout ** (level + 1)) % fanout}"
+                 for level in range(depth)]
+        suffix = ".bin" if i % 7 == 6 else ".py"
+        paths.append(os.path.join(*parts, f"file{i}{suffix}"))
+    return paths
+
+
+def write_file(f_path: Path, content: bytes):
+    f_path.parent.mkdir(parents=True, exist_ok=True)
+    with open(f_path, 'wb') as f:
+        f.write(content)
+
+
+def make_files(root, files: int, depth: int=3, file_size: int=4096,
+               binary_share: float=0.1, seed: int=0, prefix: str=""):
+    """
+    Write files under root and return their relative paths.
+    binary_share of them hold random bytes, the rest code-like text.
+    """
+    rng = random.Random(seed)
+    root = Path(root)
+    paths = [os.path.join(prefix, path) if prefix else path
+             for path in file_paths(files, depth)]
+    for path in paths:
+        size = rng.randint(file_size // 2, file_size * 3 // 2)
+        if rng.random() < binary_share:
+            content = binary_content(rng, size)
+        else:
+            content = text_content(rng, size)
+        write_file(root / path, content)
+    return paths
+
+
+def contents_tree(paths: list):
+    """Render relative paths as a Project Contents tree"""
+    nested = {}
+    for path in paths:
+        node = nested
+        for part in Path(path).parts:
+            node = node.setdefault(part, {})
+
+    lines = ["."]
+    # (children, indent) stack, children reversed so pop() keeps the order
+    stack = [(sorted(nested.items(), reverse=True), "")]
+    while stack:
+        children, indent = stack[-1]
+        if not children:
+            stack.pop()
+            continue
+        name, sub = children.pop()
+        last = not children
+        lines.append(f"{indent}{'└── ' if last else '├── '}{name}"
+                     f"     <- Description of {name}")
+        if sub:
+            stack.append((sorted(sub.items(), reverse=True),
+                          indent + ("    " if last else "│   ")))
+    return lines
+
+
+def readme_lines(title: str, headings: int, paths: list, paragraph: list):
+    """
+    A README with the template's layout: Purpose (lines 3-4 are the
+    mandatory lines), Project Description, a Project Contents tree over
+    paths and numbered sections up to headings in total, ending with License.
+    """
+    lines = [f"# {title}", "## Purpose",
+             "This line is mandatory.", "Another mandatory line.",
+             "## Project Description"]
+    lines.extend(paragraph[:3])
+    lines.append("## 1. Project Contents")
+    lines.append("```")
+    lines.extend(contents_tree(paths))
+    lines.append("```")
+    for number in range(2, max(headings - 3, 2)):
+        lines.append(f"## {number}. Section {number}")
+        lines.extend(paragraph[number * 3:number * 3 + 3])
+    lines.append(f"## {max(headings - 3, 2)}. License")
+    lines.append("MIT")
+    return lines
+
+
+def make_readme(f_path, title: str, headings: int, paths: list, paragraph: list):
+    write_file(Path(f_path),
+        ("\n".join(readme_lines(title, headings, paths, paragraph)) + "\n").encode())
+
+
+def paragraph_lines(count: int, seed: int):
+    rng = random.Random(seed)
+    words = ["data", "model", "results", "the", "project", "runs", "on",
+             "training", "a", "with", "figures", "code", "folder", "describes"]
+    return [" ".join(rng.choice(words) for _ in range(rng.randint(5, 12))) +
+            f" {seed}-{i}." for i in range(count)]
+
+
+def make_pair(root, files: int=1000, depth: int=3, file_size: int=4096,
+              binary_share: float=0.1, overlap: float=0.2,
+              headings: int=20, entries: int=50, seed: int=0):
+    """
+    Generate root/master and root/template with a README each.
+    An overlap share of the template files is copied to master unchanged,
+    so they show up as holdover items; master gets files of its own too.
+    The master README lists the first entries master files and shares an
+    overlap share of its lines with the template README.
+    """
+    root = Path(root)
+    master, template = root / "master", root / "template"
+    template_paths = make_files(template, files, depth, file_size,
+                                binary_share, seed, prefix="shared")
+    rng = random.Random(seed)
+    kept = [path for path in template_paths if rng.random() < overlap]
+    for path in kept:
+        write_file(master / path, (template / path).read_bytes())
+    master_paths = kept + make_files(master, files - len(kept), depth,
+                                     file_size, binary_share, seed + 1,
+                                     prefix="own")
+
+    line_count = headings * 3 + 3
+    template_lines = paragraph_lines(line_count, seed)
+    own_lines = paragraph_lines(line_count, seed + 1)
+    master_lines = [template_line if rng.random() < overlap else own_line
+                    for template_line, own_line in zip(template_lines, own_lines)]
+    make_readme(template / "README.md", "Template Project", headings,
+                template_paths[:entries], template_lines)
+    make_readme(master / "README.md", "My Project", headings,
+                ["README.md"] + master_paths[:max(entries - 1, 0)], master_lines)
+    return master, template
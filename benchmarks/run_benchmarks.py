@@ -0,0 +1,137 @@
+"""
+Time the public check entry points on a generated master/template pair.
+
+    python benchmarks/run_benchmarks.py --files 5000 --output before.json
+    python benchmarks/run_benchmarks.py --files 5000 --compare before.json
+
+Runs offline; the repos are generated in a temporary directory.
+"""
+import os
+import sys
+import copy
+import json
+import time
+import logging
+import argparse
+import platform
+import tempfile
+import subprocess
+from pathlib import Path
+
+REPO_ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(REPO_ROOT))
+
+from config import CONFIG
+from src import folder_tree, markdown_tree, text_tree, syntax_checker
+from benchmarks.generate import make_pair
+
+
+def bench_config():
+    """The default config, without the disk cache and the template's line numbers"""
+    config = copy.deepcopy(CONFIG)
+    config['folder_analysis']['hash_cache'] = None
+    config['readme']['mandatory_lines'] = [3, 4]
+    config['readme']['ignore_lines'] = []
+    return config
+
+
+def timeit(func, repeat: int):
+    runs = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        runs.append(time.perf_counter() - start)
+    return {"best": min(runs), "mean": sum(runs) / len(runs), "runs": runs}
+
+
+def run(root: Path, repeat: int=3):
+    """Time every entry point on root/master and root/template"""
+    config = bench_config()
+    master, template = root / "master", root / "template"
+    master_tree = folder_tree.parse(master, config, level=5)
+    template_tree = folder_tree.parse(template, config, level=5)
+    master_readme = markdown_tree.ReadmeDocument.read(master / "README.md")
+    template_readme = markdown_tree.ReadmeDocument.read(template / "README.md")
+    master_readme_tree = markdown_tree.parse(master_readme)
+    template_readme_tree = markdown_tree.parse(template_readme)
+    readme_folder_tree = text_tree.parse(master_readme)
+
+    def holdover_items():
+        # Parse again so every run hashes from scratch
+        folder_tree.scan_holdover_items(
+            folder_tree.parse(master, config, level=5),
+            folder_tree.parse(template, config, level=5))
+
+    benchmarks = {
+        "folder_tree.parse": lambda: folder_tree.parse(master, config, level=5),
+        "folder_tree.scan_holdover_items": holdover_items,
+        "syntax_checker.check_syntax":
+            lambda: syntax_checker.check_syntax(master, config),
+        "markdown_tree.check_readme": lambda: markdown_tree.check_readme(
+            master_readme_tree, template_readme_tree, config),
+        "text_tree.check_project_content":
+            lambda: text_tree.check_project_content(
+                readme_folder_tree, master_tree),
+    }
+    return {name: timeit(func, repeat) for name, func in benchmarks.items()}
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "-C", str(REPO_ROOT), "rev-parse", "HEAD"],
+            stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+            universal_newlines=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results: dict, f_name: str):
+    with open(f_name, 'r') as f:
+        previous = json.load(f)
+    print(f"Compared with {previous.get('commit')}:")
+    for name, timing in results.items():
+        before = previous["results"].get(name)
+        if before is None:
+            print(f"{name}: {timing['best']:.4f}s (new)")
+        else:
+            print(f"{name}: {before['best']:.4f}s -> {timing['best']:.4f}s "
+                  f"({timing['best'] / before['best']:.2f}x)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--files", type=int, default=1000)
+    parser.add_argument("--depth", type=int, default=3)
+    parser.add_argument("--file-size", type=int, default=4096,
+        help="Mean file size in bytes")
+    parser.add_argument("--binary-share", type=float, default=0.1)
+    parser.add_argument("--overlap", type=float, default=0.2,
+        help="Share of template files and README lines kept in master")
+    parser.add_argument("--headings", type=int, default=20)
+    parser.add_argument("--entries", type=int, default=50,
+        help="Entries in the Project Contents tree")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--output", default="benchmark_results.json")
+    parser.add_argument("--compare", metavar="PATH",
+        help="Print the time ratio against an earlier results file")
+    args = parser.parse_args()
+
+    # Findings are logged as in a real run, but not written anywhere
+    logging.getLogger().addHandler(logging.NullHandler())
+    params = {name: getattr(args, name) for name in (
+        "files", "depth", "file_size", "binary_share", "overlap",
+        "headings", "entries", "seed")}
+    with tempfile.TemporaryDirectory() as root:
+        make_pair(root, **params)
+        results = run(Path(root), args.repeat)
+
+    data = {"commit": git_commit(), "python": platform.python_version(),
+            "cpus": os.cpu_count(), "params": params, "results": results}
+    with open(args.output, 'w') as f:
+        json.dump(data, f, indent=2, sort_keys=True)
+    for name, timing in results.items():
+        print(f"{name}: best {timing['best']:.4f}s, mean {timing['mean']:.4f}s")
+    if args.compare:
+        compare(results, args.compare)
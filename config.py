@@ -1,5 +1,7 @@
 CONFIG = {
     'folder_analysis' : {
+        # Left out of the folder tree checks; the syntax check only skips
+        # hidden files (names starting with a dot)
         "exclude_filenames":{
             r"^\..*", 
             r"^__.*",
@@ -8,6 +10,29 @@ CONFIG = {
         "exclude_paths":{
             r"imgs"
             },
+        # Files that mark an empty directory as intended
+        "keep_markers":{
+            ".gitkeep",
+            },
+        # Also skip what the .gitignore files of the repo ignore
+        "use_gitignore": False,
+        # On-disk digest cache reused across runs, set to None to disable
+        # Files are re-hashed when their size, mtime or inode changes
+        "hash_cache":{
+            "path": ".pre_release_cache/hash_cache.sqlite",
+            "max_entries": 1000000,
+            "max_age_days": 30,
+            },
+        # Digest used for holdover detection: any hashlib name (eg. sha256,
+        # blake2b), an xxhash one (eg. xxh3_64) if xxhash is installed, or
+        # "git" to reuse the blob IDs in the git index of unmodified files
+        "hash_algorithm": "sha256",
+        "hash_buffer_size": 1048576,
+        # File hashing pool, None workers means one per CPU
+        # Use "process" as executor to hash in worker processes
+        "hash_workers": None,
+        "hash_executor": "thread",
+        "hash_chunk_size": 16,
     },
     'readme' : {
         "mandatory_headings":{
@@ -38,6 +63,40 @@ CONFIG = {
             "L219-220",
             "L225-227",
         ],
+        # Directory holding the README.pdf rendered from README.md, compared
+        # with the README.pdf in the repo. None to skip the PDF check
+        "rendered_pdf_dir": "pdf",
+        # Listing a directory in the Project Contents tree covers
+        # everything below it
+        "directory_covers_subtree": False,
+        # Also report lines that are near copies of a template line, by the
+        # share of word n-grams (shingles) they have in common
+        "fuzzy_match": {
+            "enabled": False,
+            "shingle_size": 3,
+            "threshold": 0.8,
+        },
+    },
+    'scheduler':{
+        # Check stages run concurrently, None for one thread per stage
+        "workers": None,
+    },
+    'syntax_check':{
+        # Files larger than this (in bytes) are not scanned, None for no limit
+        "max_file_size": 10485760,
+        # Longer lines are cut when scanning
+        "max_line_length": 65536,
+        # Files scanned concurrently, None for one worker per CPU
+        # Use "process" as executor to scan in worker processes
+        "workers": None,
+        "executor": "thread",
+    },
+    # Extra line patterns for the syntax check, matched at the start of each
+    # stripped, lower-cased line. Built-in rules "todo" and "commented_code"
+    # can be overridden here too.
+    # eg. "debug_print": {"pattern": r"print\(", "message": "Find a print at",
+    #     "level": "warning", "suffixes": [".py"]},
+    'syntax_rules':{
     },
     'commented_code':{
         # Lines does not count as commendted code
@@ -1,54 +1,384 @@
+import os
+import sys
 import argparse
-import traceback
+import threading
 import logging
-import shutil
 from pathlib import Path
-from src import folder_tree, markdown_tree, text_tree, syntax_checker, utils
+from src import instrument
 
+LOG_FILENAME = 'pre_release_check.log'
+# Depth of the folder trees compared
+TREE_LEVEL = 5
 
-def main(config):
-    matser_folder_tree = folder_tree.parse(Path("master"), config, level=5)
-    matser_folder_tree.show()
 
-    template_folder_tree = folder_tree.parse(Path("template"), config, level=5)
-    
-    folder_tree.scan_empty_dirs(matser_folder_tree)
-    folder_tree.scan_holdover_items(matser_folder_tree, template_folder_tree)
-    
-    matser_readme_tree = markdown_tree.parse(utils.get_readme_path('master'))
-    template_readme_tree = markdown_tree.parse(utils.get_readme_path('template'))
-    markdown_tree.check_readme(matser_readme_tree, template_readme_tree, config)
+def main(config, changed_paths=None, fingerprint_path=None):
+    """
+    Run every check on master against template.
+    With a set of changed paths (relative to master) the syntax and holdover
+    checks only look at those, and the README is only compared with the
+    template if it changed.
+    With a template fingerprint file the template checkout is not parsed.
+    """
+    from src import hash_cache
+    cache = hash_cache.open_cache(config)
+    try:
+        run(config, cache, changed_paths, fingerprint_path)
+    finally:
+        if cache is not None:
+            cache.close()
+
+
+def batch(repo_roots: list, output_dir=Path("pre_release_reports"),
+          jobs: int=4, template_root=Path("template"), base_ref: str=None,
+          fingerprint_path=None):
+    """
+    Check many master checkouts against one template in one process.
+    The template is parsed and hashed once per distinct set of the settings
+    it depends on (or loaded from fingerprint_path), and shared by every
+    repo using them. Up to jobs repos are checked at a time, each with its
+    own config. The rendered README PDF of a repo is looked up in
+    <rendered_pdf_dir>/<repo>/ (eg. pdf/<repo>/README.pdf). The findings
+    of each repo go to <output_dir>/<repo>.log, with a summary.json next
+    to them.
+    Return True if every repo passed.
+    """
+    import json
+    from concurrent.futures import ThreadPoolExecutor
+    from src import fingerprint, hash_cache, incremental, log_capture
+    from config import CONFIG
+
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    cache = hash_cache.open_cache(CONFIG)
+    templates = {}
+    template_lock = threading.Lock()
+
+    def template_for(config):
+        key = fingerprint.config_key(config, TREE_LEVEL)
+        with template_lock:
+            if key in templates:
+                pass
+            elif fingerprint_path:
+                templates[key] = fingerprint.Fingerprint.load(
+                    fingerprint_path, config, TREE_LEVEL, template_root)
+            else:
+                templates[key] = fingerprint.Fingerprint(fingerprint.build(
+                    template_root, config, TREE_LEVEL, cache))
+            return templates[key]
+
+    def check_repo(master_root, name):
+        with log_capture.capture_records() as records:
+            try:
+                config = load_config(master_root)
+                rendered_pdf_dir = config['readme'].get('rendered_pdf_dir', 'pdf')
+                changed_paths = incremental.changed_paths(master_root, base_ref) \
+                    if base_ref else None
+                run(config, cache, changed_paths, template_for(config),
+                    master_root, show_tree=False,
+                    rendered_pdf_root=Path(rendered_pdf_dir) / name
+                        if rendered_pdf_dir else None)
+            except Exception as e:
+                logging.exception(e)
+                logging.error("The pre-release check failed")
+        return records
+
+    names = repo_names(repo_roots)
+    try:
+        with ThreadPoolExecutor(max_workers=jobs) as pool:
+            results = list(pool.map(
+                check_repo, [Path(root) for root in repo_roots], names))
+    finally:
+        if cache is not None:
+            cache.close()
+
+    formatter = logging.Formatter(logging.BASIC_FORMAT)
+    summary = {}
+    for root, name, records in zip(repo_roots, names, results):
+        log_path = output_dir / f"{name}.log"
+        with open(log_path, 'w') as f:
+            for record in records:
+                f.write(formatter.format(record) + "\n")
+        summary[name] = {"root": str(root), "findings": len(records),
+                         "passed": not records, "log": str(log_path)}
+        print(f"{name}: {'passed' if not records else f'{len(records)} findings'}")
+    with open(output_dir / "summary.json", 'w') as f:
+        json.dump(summary, f, indent=2)
+    return all(repo["passed"] for repo in summary.values())
+
+
+def repo_names(repo_roots: list):
+    """
+    Report names for repo roots: the directory name, or its parent's for
+    a checkout named master, made unique with a number
+    """
+    names, seen = [], {}
+    for root in repo_roots:
+        root = Path(root).resolve()
+        name = root.parent.name if root.name == "master" else root.name
+        seen[name] = seen.get(name, 0) + 1
+        names.append(name if seen[name] == 1 else f"{name}_{seen[name]}")
+    return names
+
+
+def load_config(master_root=Path("master")):
+    """
+    The config of a repo from its .github/custom or .github/default folder,
+    else the default one. The file is loaded as a module of its own, so
+    the configs of several repos can be loaded in one process.
+    """
+    custom = master_root / ".github" / "custom" / "pre_release_config.py"
+    if custom.is_file():
+        f_path = custom
+        print("Using the config in .github/custom/pre_release_config.py from the repo")
+    else:
+        f_path = master_root / ".github" / "default" / "pre_release_config.py"
+        print("Using the config in .github/default/pre_release_config.py from the repo")
+    try:
+        return exec_config(f_path)
+    except Exception as e:
+        from config import CONFIG
+        print(f"Failed to load the config file from repo ({e!r})")
+        print("Using the default config")
+        return CONFIG
+
+
+_config_lock = threading.Lock()
+
+def exec_config(f_path: Path):
+    """
+    Run a config file and return its CONFIG. Its folder is put first on
+    sys.path meanwhile, so it can import modules next to it; those are
+    dropped from sys.modules afterwards, so the next repo gets its own.
+    """
+    import importlib.util
+    config_dir = str(f_path.parent.resolve())
+    with _config_lock:
+        modules = set(sys.modules)
+        sys.path.insert(0, config_dir)
+        try:
+            spec = importlib.util.spec_from_file_location("pre_release_config", f_path)
+            module = importlib.util.module_from_spec(spec)
+            spec.loader.exec_module(module)
+            return module.CONFIG
+        finally:
+            sys.path.remove(config_dir)
+            for name in set(sys.modules) - modules:
+                f_name = getattr(sys.modules[name], '__file__', None) or ''
+                if f_name.startswith(config_dir + os.sep):
+                    del sys.modules[name]
+
+
+def run(config, cache=None, changed_paths=None, fingerprint=None,
+        master_root=Path("master"), show_tree=True, rendered_pdf_root=None):
+    """
+    Declare the checks as stages of a DAG and run the independent ones
+    concurrently. Findings are logged in the order the stages are declared.
+    fingerprint is a template fingerprint file, or one already loaded.
+    The rendered README PDF is looked up in rendered_pdf_root, by default
+    the rendered_pdf_dir of the config.
+    """
+    from src import folder_tree, markdown_tree, text_tree, syntax_checker
+    from src import pdf_checker, inventory, incremental, scheduler, utils
+    hash_options = folder_tree.HashOptions.from_config(config)
+    readme_settings = config['readme']
+    checks = scheduler.Scheduler(
+        config.get('scheduler', {}).get('workers'))
+
+    # Walk master once; the folder tree and the syntax checker share it
+    checks.add("master_inventory",
+        lambda: inventory.scan(master_root, config))
+    checks.add("master_tree", lambda matser_inventory: show(folder_tree.parse(
+        master_root, config, level=TREE_LEVEL, inventory=matser_inventory),
+        show_tree), inputs=("master_inventory",))
+    if fingerprint:
+        # The template comes precompiled, a stale file fails this stage
+        from src.fingerprint import Fingerprint
+        checks.add("template_fingerprint", lambda: fingerprint
+            if isinstance(fingerprint, Fingerprint) else Fingerprint.load(
+                fingerprint, config, TREE_LEVEL, Path("template")))
+        checks.add("template_tree",
+            lambda template_fingerprint: template_fingerprint.folder_tree(),
+            inputs=("template_fingerprint",))
+        readme_inputs = ("master_readme", "master_readme_tree",
+                         "template_fingerprint")
+    else:
+        checks.add("template_tree",
+            lambda: folder_tree.parse(Path("template"), config, level=TREE_LEVEL))
+        readme_inputs = ("master_readme", "master_readme_tree")
+
+    checks.add("empty_dirs", folder_tree.scan_empty_dirs,
+        inputs=("master_tree",))
+    checks.add("holdover_items",
+        lambda matser_folder_tree, template_folder_tree:
+            folder_tree.scan_holdover_items(
+                matser_folder_tree, template_folder_tree, cache, hash_options,
+                paths=incremental.with_ancestors(changed_paths)
+                    if changed_paths is not None else None),
+        inputs=("master_tree", "template_tree"))
+
+    # Each README is read once and shared by the markdown and text trees
+    checks.add("master_readme", lambda: markdown_tree.ReadmeDocument.read(
+        utils.get_readme_path(master_root)))
+    checks.add("master_readme_tree", markdown_tree.parse,
+        inputs=("master_readme",))
+    checks.add("readme",
+        lambda matser_readme, matser_readme_tree, template_fingerprint=None:
+            check_readme(matser_readme, matser_readme_tree, config,
+                         changed_paths, template_fingerprint, master_root),
+        inputs=readme_inputs)
+
+    # Check the README PDF against the one rendered from README.md
+    rendered_pdf_dir = readme_settings.get('rendered_pdf_dir', 'pdf')
+    if rendered_pdf_root is None and rendered_pdf_dir:
+        rendered_pdf_root = Path(rendered_pdf_dir)
+    if rendered_pdf_root is not None:
+        checks.add("readme_pdf", lambda: pdf_checker.compare_readme(
+            master_root, rendered_pdf_root, cache,
+            hash_options.algorithm))
 
     # Check unresolved to~do tags and commented code
-    syntax_checker.check_syntax(Path("master"), config)
-    matser_readme_folder_tree = text_tree.parse(
-        matser_readme_tree, utils.get_readme_path('master'))
+    checks.add("syntax", lambda matser_inventory: syntax_checker.check_syntax(
+        master_root, config,
+        inventory=matser_inventory.subset(changed_paths)
+            if changed_paths is not None else matser_inventory),
+        inputs=("master_inventory",))
+
+    checks.add("project_contents",
+        lambda matser_readme, matser_folder_tree: text_tree.check_project_content(
+            text_tree.parse(matser_readme), matser_folder_tree,
+            readme_settings.get('directory_covers_subtree', False)),
+        inputs=("master_readme", "master_tree"))
+
+    return checks.run()
+
+
+def show(folder_tree, show_tree=True):
+    if show_tree:
+        folder_tree.show()
+    return folder_tree
+
+
+def check_readme(matser_readme, matser_readme_tree, config, changed_paths=None,
+                 template_fingerprint=None, master_root=Path("master")):
+    """Compare the README with the template's, unless it did not change"""
+    if changed_paths is not None and \
+       str(matser_readme.path.relative_to(master_root)) not in changed_paths:
+        return
+    from src import markdown_tree, utils
+    if template_fingerprint is not None:
+        template_readme = template_fingerprint.readme_lines()
+    else:
+        template_readme = markdown_tree.parse(markdown_tree.ReadmeDocument.read(
+            utils.get_readme_path('template')))
+    markdown_tree.check_readme(matser_readme_tree, template_readme, config)
 
-    text_tree.check_project_content(
-        matser_readme_folder_tree, matser_folder_tree)
+
+def summarize(log_filename=LOG_FILENAME):
+    """
+    Print the log and the action's output message, and return the exit
+    status: the check passes only if nothing was logged
+    """
+    try:
+        with open(log_filename, 'r', errors='replace') as f:
+            log = f.read()
+    except FileNotFoundError:
+        log = ''
+    print(log, end='')
+    if log.count('\n') == 0:
+        print("::set-output name=message::Pre-release check passed")
+        return 0
+    message = log.replace('\n', ' ')
+    print(f"::set-output name=message::{message}")
+    return 1
 
 
 if __name__ == "__main__":
 
-    LOG_FILENAME = 'pre_release_check.log'
+    parser = argparse.ArgumentParser(description="Run the pre-release checks")
+    parser.add_argument(
+        "--base-ref",
+        help="Only check what changed in master since this git ref "
+             "(eg. the last release tag)")
+    parser.add_argument(
+        "--changed-paths", nargs="+", metavar="PATH",
+        help="Only check these paths, relative to master")
+    parser.add_argument(
+        "--timing-report", default="pre_release_timing.json", metavar="PATH",
+        help="Write the time, files, bytes and peak memory of every stage "
+             "here as JSON")
+    parser.add_argument(
+        "--profile", metavar="PATH",
+        help="Profile every stage with cProfile and dump the merged stats here")
+    parser.add_argument(
+        "--fingerprint", metavar="PATH",
+        help="Compare with a template fingerprint file instead of parsing "
+             "the template checkout")
+    parser.add_argument(
+        "--build-fingerprint", metavar="PATH",
+        help="Compile the template checkout into a fingerprint file and exit")
+    parser.add_argument(
+        "--repos", nargs="+", metavar="ROOT",
+        help="Check these master checkouts against template in one run")
+    parser.add_argument(
+        "--output-dir", default="pre_release_reports", metavar="PATH",
+        help="Where --repos writes the findings of each repo")
+    parser.add_argument(
+        "--jobs", type=int, default=4,
+        help="Repos checked at the same time with --repos")
+    parser.add_argument(
+        "--watch", action="store_true",
+        help="Keep running and check master again on every change")
+    parser.add_argument(
+        "--poll-interval", type=float, default=0.5, metavar="SECONDS",
+        help="How often --watch looks for changes where inotify is missing")
+    args = parser.parse_args()
+    instrument.profiling = args.profile is not None
+
     logging.basicConfig(filename=LOG_FILENAME,level=logging.WARNING)
     
-    try:
-        import os, sys
-        if os.path.isfile("master/.github/custom/pre_release_config.py"):
-            sys.path.append("master/.github/custom")
-            print("Using the config in .github/custom/pre_release_config.py from the repo")
-        else:
-            sys.path.append("master/.github/default")
-            print("Using the config in .github/default/pre_release_config.py from the repo")
-        from pre_release_config import CONFIG
-    except:
-        from config import CONFIG
-        print("Failed to load the config file from repo")
-        print("Using the default config")
+    if args.repos:
+        passed = batch(args.repos, Path(args.output_dir), args.jobs,
+                       base_ref=args.base_ref, fingerprint_path=args.fingerprint)
+        instrument.write_report(args.timing_report)
+        if args.profile:
+            instrument.write_profile(args.profile)
+        sys.exit(0 if passed else 1)
+
+    CONFIG = load_config(Path("master"))
+
+    if args.watch:
+        from src import watch
+        template_fingerprint = None
+        if args.fingerprint:
+            from src.fingerprint import Fingerprint
+            template_fingerprint = Fingerprint.load(
+                args.fingerprint, CONFIG, TREE_LEVEL, Path("template"))
+        watch.watch(CONFIG, Path("master"), Path("template"),
+                    template_fingerprint, TREE_LEVEL, args.poll_interval)
+        sys.exit(0)
+
+    if args.build_fingerprint:
+        from src import fingerprint
+        fingerprint.write(args.build_fingerprint, fingerprint.build(
+            Path("template"), CONFIG, TREE_LEVEL))
+        print(f"Wrote the template fingerprint to {args.build_fingerprint}")
+        sys.exit(0)
+
+    changed_paths = None
+    if args.changed_paths:
+        from src import incremental
+        changed_paths = incremental.read_paths(args.changed_paths)
+    elif args.base_ref:
+        from src import incremental
+        changed_paths = incremental.changed_paths(Path("master"), args.base_ref)
 
     try:
-        main(CONFIG)
+        main(CONFIG, changed_paths, args.fingerprint)
     except Exception as e:
         logging.exception(e)
         logging.error("The pre-release check failed")
+
+    instrument.write_report(args.timing_report)
+    if args.profile:
+        instrument.write_profile(args.profile)
+    sys.exit(summarize())
@@ -0,0 +1,273 @@
+from array import array
+
+# Parent index of a removed node
+REMOVED = -2
+
+
+class Node(object):
+    """Lightweight view of one node of a Tree, created on access"""
+    __slots__ = ('_tree', 'index')
+
+    def __init__(self, tree, index: int):
+        self._tree = tree
+        self.index = index
+
+    @property
+    def tag(self):
+        return self._tree.strings[self._tree.tag_ids[self.index]]
+
+    @property
+    def identifier(self):
+        return self._tree.identifier_of(self.index)
+
+    @property
+    def data(self):
+        return self._tree.data[self.index]
+
+    @data.setter
+    def data(self, value):
+        self._tree.data[self.index] = value
+
+    def is_leaf(self):
+        return self._tree.first_child[self.index] < 0
+
+    def __repr__(self):
+        return f"Node(tag={self.tag!r}, identifier={self.identifier!r})"
+
+
+class Tree(object):
+    """
+    Array-backed tree.
+    Node i is stored across parallel arrays: its parent, first child, next
+    sibling and last child indexes, and its tag as an index into an interned
+    string table. Payloads live in a plain list. Identifiers default to the
+    node index; a lookup dict is only built once a node is given an
+    identifier that differs from its index. Removed nodes keep their slot
+    and are skipped when listing nodes.
+    """
+    def __init__(self):
+        self.parent = array('l')
+        self.first_child = array('l')
+        self.last_child = array('l')
+        self.next_sibling = array('l')
+        self.tag_ids = array('l')
+        self.strings = []
+        self._string_ids = {}
+        self.data = []
+        # Only used when identifiers differ from node indexes
+        self.identifiers = None
+        self.index_of = None
+        self.removed = 0
+        # Insertion order is pre-order until a node is added with sort
+        self.in_pre_order = True
+
+    def __len__(self):
+        return len(self.parent)
+
+    def __contains__(self, nid):
+        return self.index(nid) is not None
+
+    @property
+    def root(self):
+        return self.identifier_of(0) if len(self) else None
+
+    def intern(self, text: str):
+        string_id = self._string_ids.get(text)
+        if string_id is None:
+            string_id = self._string_ids[text] = len(self.strings)
+            self.strings.append(text)
+        return string_id
+
+    def index(self, nid):
+        if self.index_of is None:
+            if isinstance(nid, int) and 0 <= nid < len(self) and \
+               self.parent[nid] != REMOVED:
+                return nid
+            return None
+        return self.index_of.get(nid)
+
+    def identifier_of(self, index: int):
+        return index if self.identifiers is None else self.identifiers[index]
+
+    def create_node(self, tag: str, identifier=None, parent=None, data=None,
+                    sort: bool=False):
+        """
+        Add a node under parent (an identifier) and return its identifier.
+        With sort, the node goes before the first sibling with a greater tag,
+        so children sorted by tag stay sorted.
+        """
+        index = len(self)
+        if identifier is None:
+            identifier = index
+        if identifier != index and self.index_of is None:
+            self.identifiers = list(range(index))
+            self.index_of = {i: i for i in range(index)}
+        if self.index_of is not None:
+            if identifier in self.index_of:
+                raise ValueError(f"Duplicated node identifier {identifier}")
+            self.identifiers.append(identifier)
+            self.index_of[identifier] = index
+
+        if parent is None:
+            if index:
+                raise ValueError("The tree already has a root node")
+            parent_index = -1
+        else:
+            parent_index = self.index(parent)
+            if parent_index is None:
+                raise ValueError(f"Parent node {parent} is not in the tree")
+
+        self.parent.append(parent_index)
+        self.first_child.append(-1)
+        self.last_child.append(-1)
+        self.next_sibling.append(-1)
+        self.tag_ids.append(self.intern(tag))
+        self.data.append(data)
+        if parent_index >= 0:
+            before = -1
+            last = self.last_child[parent_index]
+            if sort:
+                self.in_pre_order = False
+            if sort and last >= 0 and self.strings[self.tag_ids[last]] > tag:
+                before = self.first_child[parent_index]
+                while self.strings[self.tag_ids[before]] <= tag:
+                    before = self.next_sibling[before]
+            self.link(parent_index, index, before)
+        return identifier
+
+    def link(self, parent_index: int, index: int, before: int=-1):
+        """Put a node in the children of a parent, before a sibling or last"""
+        if before < 0:
+            if self.first_child[parent_index] < 0:
+                self.first_child[parent_index] = index
+            else:
+                self.next_sibling[self.last_child[parent_index]] = index
+            self.last_child[parent_index] = index
+            return
+        self.next_sibling[index] = before
+        if self.first_child[parent_index] == before:
+            self.first_child[parent_index] = index
+            return
+        previous = self.first_child[parent_index]
+        while self.next_sibling[previous] != before:
+            previous = self.next_sibling[previous]
+        self.next_sibling[previous] = index
+
+    def remove_node(self, nid):
+        """Remove a node and its subtree, their slots are not reused"""
+        index = self.index(nid)
+        if index is None:
+            raise ValueError(f"Node {nid} is not in the tree")
+        parent_index = self.parent[index]
+        if parent_index < 0:
+            raise ValueError("The root node can not be removed")
+        previous = -1
+        child = self.first_child[parent_index]
+        while child != index:
+            previous = child
+            child = self.next_sibling[child]
+        if previous < 0:
+            self.first_child[parent_index] = self.next_sibling[index]
+        else:
+            self.next_sibling[previous] = self.next_sibling[index]
+        if self.last_child[parent_index] == index:
+            self.last_child[parent_index] = previous
+
+        stack = [index]
+        while stack:
+            index = stack.pop()
+            stack.extend(self.child_indexes(index))
+            self.parent[index] = REMOVED
+            self.data[index] = None
+            if self.index_of is not None:
+                del self.index_of[self.identifiers[index]]
+            self.removed += 1
+
+    def get_node(self, nid):
+        index = self.index(nid)
+        return None if index is None else Node(self, index)
+
+    def child_indexes(self, index: int):
+        children = []
+        child = self.first_child[index]
+        while child >= 0:
+            children.append(child)
+            child = self.next_sibling[child]
+        return children
+
+    def child_ids(self, nid):
+        """Identifiers of the children of a node, in insertion order"""
+        return [self.identifier_of(i) for i in self.child_indexes(self.index(nid))]
+
+    def children(self, nid):
+        return [Node(self, i) for i in self.child_indexes(self.index(nid))]
+
+    def indexes(self):
+        """Indexes of every node not removed, in insertion order"""
+        if not self.removed:
+            return range(len(self))
+        return [i for i in range(len(self)) if self.parent[i] != REMOVED]
+
+    def all_nodes(self):
+        """Every node in insertion order, or in pre-order once sort was used"""
+        if not self.in_pre_order:
+            return [Node(self, i) for i in self.depth_first()]
+        return [Node(self, i) for i in self.indexes()]
+
+    def filter_nodes(self, func):
+        return (node for node in self.all_nodes() if func(node))
+
+    def leaves(self):
+        return [Node(self, i) for i in self.indexes() if self.first_child[i] < 0]
+
+    def depth_first(self):
+        """Node indexes in pre-order, children in insertion order"""
+        order = []
+        stack = [0] if len(self) else []
+        while stack:
+            index = stack.pop()
+            order.append(index)
+            stack.extend(reversed(self.child_indexes(index)))
+        return order
+
+    def ancestry(self, index: int):
+        """Node indexes from the root down to a node"""
+        indexes = []
+        while index >= 0:
+            indexes.append(index)
+            index = self.parent[index]
+        return indexes[::-1]
+
+    def relative_path(self, nid):
+        """Tags from below the root down to a node"""
+        return [self.strings[self.tag_ids[i]]
+                for i in self.ancestry(self.index(nid))[1:]]
+
+    def paths_to_leaves(self):
+        """Identifier paths from the root to every leaf"""
+        return [[self.identifier_of(i) for i in self.ancestry(node.index)]
+                for node in self.leaves()]
+
+    def show(self, key=None, reverse: bool=False):
+        """Print the tree, children sorted by key (tag by default)"""
+        if not len(self):
+            return
+        key = key or (lambda node: node.tag)
+        lines = [Node(self, 0).tag]
+        # Stack of (node, prefix of its line, is last child)
+        stack = []
+
+        def push_children(index, prefix):
+            children = sorted(
+                (Node(self, i) for i in self.child_indexes(index)),
+                key=key, reverse=reverse)
+            for position in reversed(range(len(children))):
+                stack.append(
+                    (children[position], prefix, position == len(children) - 1))
+
+        push_children(0, "")
+        while stack:
+            node, prefix, is_last = stack.pop()
+            lines.append(prefix + ("└── " if is_last else "├── ") + node.tag)
+            push_children(node.index, prefix + ("    " if is_last else "│   "))
+        print("\n".join(lines) + "\n")
@@ -0,0 +1,144 @@
+import os
+import re
+
+
+ESCAPED_CHAR = re.compile(r'\\(.)')
+
+def literal_name(pattern: str):
+    """The name matched by a regex without special characters, or None"""
+    name = ESCAPED_CHAR.sub(r'\1', pattern)
+    return name if re.escape(name) == pattern else None
+
+
+class ExclusionRules(object):
+    """
+    The exclude_filenames/exclude_paths settings compiled once.
+    Names are matched with re.match semantics: exact names (`^name$` or
+    `name$`) go in a set and every other pattern is joined into one regex.
+    Path suffixes are grouped by length, so each check is one slice and one
+    set lookup per distinct length.
+    """
+    def __init__(self, exclude_filenames, exclude_paths):
+        self.names = set()
+        patterns = []
+        for pattern in exclude_filenames:
+            body = pattern[1:] if pattern.startswith('^') else pattern
+            name = literal_name(body[:-1]) if body.endswith('$') else None
+            if name:
+                self.names.add(name)
+            else:
+                patterns.append(f'(?:{pattern})')
+        self.name_prog = re.compile('|'.join(patterns)) if patterns else None
+
+        self.suffixes = {}
+        for suffix in exclude_paths:
+            self.suffixes.setdefault(len(suffix), set()).add(suffix)
+
+    @classmethod
+    def from_config(cls, config: dict):
+        settings = config['folder_analysis']
+        return cls(settings['exclude_filenames'], settings['exclude_paths'])
+
+    def excludes(self, name: str, path: str):
+        if name in self.names:
+            return True
+        if self.name_prog is not None and self.name_prog.match(name):
+            return True
+        return any(path[-length:] in suffixes
+            for length, suffixes in self.suffixes.items())
+
+
+def translate_pattern(pattern: str):
+    """Convert a gitignore glob to a regex source, without anchors"""
+    out = []
+    i = 0
+    while i < len(pattern):
+        if pattern.startswith('**/', i):
+            out.append('(?:.*/)?')
+            i += 3
+        elif pattern.startswith('**', i):
+            out.append('.*')
+            i += 2
+        elif pattern[i] == '*':
+            out.append('[^/]*')
+            i += 1
+        elif pattern[i] == '?':
+            out.append('[^/]')
+            i += 1
+        elif pattern[i] == '[' and ']' in pattern[i + 2:]:
+            end = pattern.index(']', i + 2)
+            body = pattern[i + 1:end]
+            if body.startswith('!'):
+                body = '^' + body[1:]
+            out.append('[' + body.replace('\\', '\\\\') + ']')
+            i = end + 1
+        elif pattern[i] == '\\' and i + 1 < len(pattern):
+            out.append(re.escape(pattern[i + 1]))
+            i += 2
+        else:
+            out.append(re.escape(pattern[i]))
+            i += 1
+    return ''.join(out)
+
+
+class IgnoreRule(object):
+    __slots__ = ('prog', 'negate', 'dir_only')
+
+    def __init__(self, line: str):
+        self.negate = line.startswith('!')
+        if self.negate:
+            line = line[1:]
+        self.dir_only = line.endswith('/')
+        line = line.rstrip('/')
+        # A slash anywhere but at the end anchors the pattern to the
+        # directory of the .gitignore file
+        anchored = '/' in line
+        line = line.lstrip('/')
+        prefix = '' if anchored else '(?:.*/)?'
+        self.prog = re.compile(prefix + translate_pattern(line) + '$')
+
+
+class GitIgnore(object):
+    """The rules of one .gitignore file, relative to its directory"""
+    def __init__(self, base: str, lines: list):
+        self.base = base
+        self.rules = []
+        for line in lines:
+            line = line.rstrip('\n')
+            if not line.endswith('\\ '):
+                line = line.rstrip()
+            if not line or line.startswith('#'):
+                continue
+            self.rules.append(IgnoreRule(line))
+
+    @classmethod
+    def read(cls, f_path: str, base: str):
+        try:
+            with open(f_path, 'r', errors='replace') as f:
+                lines = f.readlines()
+        except OSError:
+            return None
+        ignore = cls(base, lines)
+        return ignore if ignore.rules else None
+
+
+def is_ignored(ignores: tuple, rel_path: str, is_dir: bool):
+    """
+    Apply the .gitignore files from the outermost to the innermost one,
+    the last matching rule wins like in git.
+    """
+    ignored = False
+    for ignore in ignores:
+        path = rel_path[len(ignore.base) + 1:] if ignore.base else rel_path
+        for rule in ignore.rules:
+            if rule.dir_only and not is_dir:
+                continue
+            if rule.prog.match(path):
+                ignored = not rule.negate
+    return ignored
+
+
+def load_ignores(dir_path: str, dir_rel_path: str, parent_ignores: tuple):
+    """The .gitignore files in effect inside a directory"""
+    ignore = GitIgnore.read(os.path.join(dir_path, '.gitignore'), dir_rel_path)
+    return parent_ignores + (ignore,) if ignore else parent_ignores
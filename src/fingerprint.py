@@ -0,0 +1,126 @@
+import os
+import json
+import hashlib
+import subprocess
+from pathlib import Path
+from src import folder_tree, markdown_tree, utils
+from src.inventory import Entry, Inventory
+from src.incremental import git
+
+# Bump when the layout of the file changes
+FORMAT_VERSION = 1
+
+
+def config_key(config: dict, level: int):
+    """Digest of the settings a fingerprint depends on"""
+    folder_settings = config['folder_analysis']
+    readme_settings = config['readme']
+    settings = {
+        "exclude_filenames": sorted(folder_settings['exclude_filenames']),
+        "exclude_paths": sorted(folder_settings['exclude_paths']),
+        "use_gitignore": folder_settings.get('use_gitignore', False),
+        "hash_algorithm": folder_settings.get('hash_algorithm', 'sha256'),
+        "mandatory_lines": sorted(
+            utils.parser_line_no(readme_settings['mandatory_lines'])),
+        "level": level,
+    }
+    return hashlib.sha256(
+        json.dumps(settings, sort_keys=True).encode()).hexdigest()
+
+
+def template_head(template_root: Path):
+    """The commit checked out in template_root, or None outside a git work tree"""
+    try:
+        return git(template_root, "rev-parse", "HEAD")[0]
+    except (OSError, IndexError, subprocess.CalledProcessError):
+        return None
+
+
+def build(template_root: Path, config: dict, level: int=-1, cache=None):
+    """
+    Parse and fully hash the template once, and return the fingerprint
+    data: every path with its size and digest (in tree order), and the
+    template README lines check_readme compares against
+    """
+    tree = folder_tree.parse(template_root, config, level=level)
+    folder_tree.hash_tree(tree, cache, folder_tree.HashOptions.from_config(config))
+    nodes = []
+    for node in tree.all_nodes():
+        entry = folder_tree.node_entry(node)
+        nodes.append([entry.rel_path, entry.is_dir, entry.size, node.data.hash])
+
+    readme_tree = markdown_tree.parse(markdown_tree.ReadmeDocument.read(
+        utils.get_readme_path(template_root)))
+    readme_lines = markdown_tree.TemplateLines.from_tree(readme_tree, config)
+    return {
+        "format": FORMAT_VERSION,
+        "config": config_key(config, level),
+        "template_head": template_head(template_root),
+        "nodes": nodes,
+        "readme_lines": list(readme_lines.lines.items()),
+        "mandatory_lines": list(readme_lines.mandatory_lines.items()),
+    }
+
+
+def write(f_path, data: dict):
+    with open(f_path, 'w') as f:
+        json.dump(data, f, separators=(',', ':'))
+
+
+class Fingerprint(object):
+    """
+    A template compiled by build(), loaded with a single read.
+    Stands in for the template checkout: the folder tree comes back with
+    every digest set, so holdover detection never reads a template file.
+    """
+    def __init__(self, data: dict):
+        self.data = data
+
+    @classmethod
+    def load(cls, f_path, config: dict, level: int=-1,
+             template_root: Path=None):
+        """
+        Read a fingerprint and raise ValueError if it is stale: built by
+        another format version, with other settings, or from another
+        commit than the one checked out in template_root (if any)
+        """
+        with open(f_path, 'rb') as f:
+            data = json.loads(f.read())
+        problem = None
+        if data.get("format") != FORMAT_VERSION:
+            problem = f"format {data.get('format')}, expected {FORMAT_VERSION}"
+        elif data.get("config") != config_key(config, level):
+            problem = "built with other folder_analysis/readme settings"
+        elif template_root is not None and Path(template_root).is_dir():
+            head = template_head(template_root)
+            if head is not None and head != data.get("template_head"):
+                problem = f"built from {data.get('template_head')}, " \
+                          f"but {template_root} is at {head}"
+        if problem:
+            raise ValueError(
+                f"The template fingerprint {f_path} is stale ({problem}), "
+                "rebuild it with --build-fingerprint")
+        return cls(data)
+
+    def folder_tree(self, root=Path("template")):
+        """The template folder tree with every node hashed"""
+        root = str(root)
+        inventory = Inventory(root)
+        digests = {}
+        for rel_path, is_dir, size, digest in self.data["nodes"]:
+            digests[rel_path] = digest
+            if rel_path == '.':
+                continue
+            path = os.path.join(root, rel_path)
+            inventory.add(Entry(
+                path, rel_path, os.path.basename(rel_path),
+                os.path.dirname(path), rel_path.count(os.sep) + 1,
+                is_dir, size))
+        tree = folder_tree.parse(Path(root), None, inventory=inventory)
+        for node in tree.all_nodes():
+            node.data.hash = digests[folder_tree.node_entry(node).rel_path]
+        return tree
+
+    def readme_lines(self):
+        return markdown_tree.TemplateLines(
+            dict(self.data["readme_lines"]), dict(self.data["mandatory_lines"]))
@@ -1,91 +1,275 @@
 
-import re
+import os
 import hashlib
 import logging
+import threading
 from pathlib import Path
-from itertools import islice
 from functools import partial
-from treelib import tree
-
-
-def tree_clean_up(contents: list, exclude_filenames: list, exclude_paths: list):
-    contents = [_x for _x in contents \
-        if not any(re.match(_pattern, _x.parts[-1]) for _pattern in exclude_filenames)]
-    contents = [_x for _x in contents \
-        if not any(str(_x).endswith(_path) for _path in exclude_paths)]
-    return sorted(contents)
+from concurrent import futures
+from src.compact_tree import Tree
+from src.inventory import Inventory, scan
+from src.hash_cache import HashCache
+from src.git_objects import GIT_ALGORITHM, blob_header, tracked_blobs
+from src import instrument
 
 
 def parse(
     dir_path: Path, config : dict, 
     level: int=-1, limit_to_directories: bool=False,
+    inventory: Inventory=None,
     ):
-    """Given a directory Path object to parse a tree structure"""
-
-    clean_up =partial(
-        tree_clean_up,
-        exclude_filenames = config['folder_analysis']['exclude_filenames'], 
-        exclude_paths = config['folder_analysis']['exclude_paths'])
-
-    dir_tree = tree.Tree()
-    dir_tree.create_node('.', dir_path)  # root node
-
-    def inner(dir_path: Path, level=-1):
-        if not level: 
-            return # 0, stop iterating
-        if limit_to_directories:
-            contents = [d for d in dir_path.iterdir() if d.is_dir()]
-        else: 
-            contents = list(dir_path.iterdir())
-        contents = clean_up(contents)
-        for path in contents:
-            if path.is_dir():
-                dir_tree.create_node(str(path.parts[-1]), path, path.parent)
-                yield 
-                yield from inner(path, level=level-1)
-            elif not limit_to_directories:
-                dir_tree.create_node(str(path.parts[-1]), path, path.parent)
-                yield
-
-    _ = list(inner(dir_path, level=level))
-    hash_tree(dir_tree)
+    """
+    Given a directory Path object to parse a tree structure
+    The tree is built from an Inventory; pass one in to reuse an existing walk.
+    Entries excluded by the exclude_filenames/exclude_paths rules are left out.
+    Empty directories are marked right away, content hashes are only
+    computed on demand by hash_tree/hash_subtrees.
+    """
+    if inventory is None:
+        inventory = scan(dir_path, config)
+
+    dir_tree = Tree()
+    root_entry = inventory.root_entry
+    root_id = dir_tree.create_node('.', data=Node_data(None, None, root_entry))
+    dir_ids = {root_entry.path: root_id}
+
+    # Inventory entries are in pre-order, so a parent always exists
+    # before its children are added
+    for entry in inventory:
+        if entry.excluded:
+            continue
+        if level >= 0 and entry.depth > level:
+            continue
+        if limit_to_directories and not entry.is_dir:
+            continue
+        nid = dir_tree.create_node(
+            entry.name, parent=dir_ids[entry.parent],
+            data=Node_data(None, None, entry))
+        if entry.is_dir:
+            dir_ids[entry.path] = nid
+
+    mark_empty_dirs(dir_tree)
 
     return dir_tree
 
+
+class HashOptions(object):
+    """File hashing settings, read from folder_analysis"""
+    def __init__(
+        self, algorithm: str="sha256", buffer_size: int=1 << 20,
+        workers: int=1, use_processes: bool=False, chunk_size: int=16,
+        ):
+        self.algorithm = algorithm
+        self.buffer_size = buffer_size
+        self.workers = workers
+        self.use_processes = use_processes
+        self.chunk_size = chunk_size
+
+    @classmethod
+    def from_config(cls, config: dict):
+        settings = config['folder_analysis']
+        return cls(
+            algorithm=settings.get('hash_algorithm', 'sha256'),
+            buffer_size=settings.get('hash_buffer_size', 1 << 20),
+            workers=settings.get('hash_workers') or os.cpu_count() or 1,
+            use_processes=settings.get('hash_executor', 'thread') == 'process',
+            chunk_size=settings.get('hash_chunk_size', 16),
+        )
+
+
 class Node_data(object):
-    def __init__(self, hash_value, is_empty_dir):
+    __slots__ = ('hash', 'is_empty_dir', 'entry')
+
+    def __init__(self, hash_value, is_empty_dir, entry=None):
         self.hash = hash_value
         self.is_empty_dir = is_empty_dir
+        self.entry = entry
         
-def hash_tree(tree):
-    root = tree.get_node(tree.root)
-    if root.is_leaf():
-        hash_leaf(root)
+def post_order(tree, node_ids: list, skip=None):
+    """
+    Return the nodes of the subtrees rooted at node_ids, every node after
+    all of its descendants. Nodes for which skip(node) is true are left out
+    together with their subtrees.
+    """
+    seen = set()
+    order = []
+    for start_id in node_ids:
+        # Any order where a node precedes its descendants works; reversing it
+        # gives a post-order. Subtrees collected earlier come first, which
+        # keeps the whole list valid when one start node contains another.
+        pre_order = []
+        stack = [start_id]
+        while stack:
+            nid = stack.pop()
+            if nid in seen:
+                continue
+            seen.add(nid)
+            node = tree.get_node(nid)
+            if skip is not None and skip(node):
+                continue
+            pre_order.append(node)
+            stack.extend(tree.child_ids(nid))
+        order.extend(reversed(pre_order))
+    return order
+
+
+def is_file_node(node):
+    return not node.data.entry.is_dir
+
+
+def mark_empty_dirs(tree):
+    """Set is_empty_dir bottom-up without touching the disk"""
+    for node in post_order(tree, [tree.root]):
+        mark_empty_dir(node, tree.children(node.identifier))
+
+
+def mark_empty_dir(node, children: list):
+    if children:
+        node.data.is_empty_dir = all(
+            child.data.is_empty_dir for child in children)
     else:
+        node.data.is_empty_dir = not is_file_node(node)
+
+
+@instrument.timed("folder_tree.hash_tree")
+def hash_tree(tree, cache: HashCache=None, options: HashOptions=None):
+    """Hash every node of a folder tree"""
+    hash_subtrees(tree, [tree.root], cache, options)
+
+
+@instrument.timed("folder_tree.hash_subtrees")
+def hash_subtrees(
+    tree, node_ids: list, cache: HashCache=None, options: HashOptions=None,
+    ):
+    """
+    Hash the subtrees rooted at node_ids bottom-up, skipping nodes already
+    hashed. All file leaves are hashed first, on a worker pool when
+    workers > 1, then each node is visited once, children before their
+    parent, so the work is linear and no recursion is involved.
+    """
+    options = options or HashOptions()
+    nodes = post_order(tree, node_ids, skip=lambda node: node.data.hash)
+    leaves = [node for node in nodes if node.is_leaf()]
+    blobs = None
+    if options.algorithm == GIT_ALGORITHM and leaves:
+        blobs = tracked_blobs(node_entry(tree.get_node(tree.root)).path)
+    digests = hash_leaves(leaves, cache, options, blobs)
+
+    for node in nodes:
+        children = tree.children(node.identifier)
+        if not children:
+            hash_leaf(node, digests.get(node.identifier), options)
+            continue
         m = hashlib.sha256()
-        is_empty_dir = True
-        for child in tree.children(root.identifier):
-            hash_tree(tree.subtree(child.identifier))
+        for child in children:
             m.update(str.encode(child.data.hash))
-            is_empty_dir = is_empty_dir & child.data.is_empty_dir
-        root.data = Node_data(m.hexdigest(), is_empty_dir)
-            
-def hash_leaf(node):
-    if node.identifier.is_file():
-        node.data = Node_data(hash_file(node.identifier), False)
+        node.data.hash = m.hexdigest()
+
+
+def hash_leaves(
+    leaves: list, cache: HashCache=None, options: HashOptions=None,
+    blobs: dict=None,
+    ):
+    """
+    Hash the file leaves not found in blobs (git blob OIDs keyed on
+    relative path) or the cache, concurrently.
+    Return the digests keyed on node identifier.
+    """
+    options = options or HashOptions()
+    blobs = blobs or {}
+    digests = {}
+    pending = []
+    for node in leaves:
+        entry = node_entry(node)
+        if entry.is_dir:
+            continue
+        digest = blobs.get(entry.rel_path)
+        if digest is not None:
+            digests[node.identifier] = digest
+            continue
+        digest = cache.get(entry, options.algorithm) \
+            if cache is not None else None
+        if digest is None:
+            pending.append(node)
+        else:
+            digests[node.identifier] = digest
+
+    paths = [node_entry(node).path for node in pending]
+    hash_path = partial(
+        hash_file, algorithm=options.algorithm, buffer_size=options.buffer_size)
+    if options.workers > 1 and len(paths) > 1:
+        # ProcessPoolExecutor (and multiprocessing) is only imported if used
+        pool_class = futures.ProcessPoolExecutor if options.use_processes \
+            else futures.ThreadPoolExecutor
+        with pool_class(max_workers=min(options.workers, len(paths))) as pool:
+            results = list(pool.map(
+                instrument.bind(hash_path), paths, chunksize=options.chunk_size))
+    else:
+        results = [hash_path(path) for path in paths]
+
+    for node, digest in zip(pending, results):
+        digests[node.identifier] = digest
+        if cache is not None:
+            cache.put(node_entry(node), digest, options.algorithm)
+    return digests
+
+def node_entry(node):
+    return node.data.entry
+
+def hash_leaf(node, digest: str=None, options: HashOptions=None):
+    if is_file_node(node):
+        if digest is None:
+            options = options or HashOptions()
+            digest = hash_file(
+                node_entry(node).path, options.algorithm, options.buffer_size)
+        node.data.hash = digest
     else:
         # Empty folder
-        node.data = Node_data(hashlib.sha256(b"empty").hexdigest(), True)
-
-def hash_file(f_path):
-    m = hashlib.sha256()
-    f = open(f_path, 'rb')
-    for _ in range(1000):
-        # Read file in as little chunks, up to 4 MB
-        buf = f.read(4096)
-        if not buf : break
-        m.update(buf)
-    f.close()
+        node.data.hash = hashlib.sha256(b"empty").hexdigest()
+    node.data.is_empty_dir = not is_file_node(node)
+
+
+XXHASH_ALGORITHMS = {"xxh32", "xxh64", "xxh3_64", "xxh3_128", "xxh128"}
+
+def new_hasher(algorithm: str="sha256", size: int=None):
+    """
+    Return a hash object for a hashlib algorithm name (eg. sha256, blake2b)
+    or an xxhash one (eg. xxh3_64) when the xxhash package is installed.
+    "git" hashes like git does blobs of the given content size.
+    """
+    if algorithm == GIT_ALGORITHM:
+        m = hashlib.sha1()
+        m.update(blob_header(size))
+        return m
+    if algorithm in XXHASH_ALGORITHMS:
+        try:
+            import xxhash
+        except ImportError:
+            raise ValueError(
+                f"The {algorithm} hash algorithm needs the xxhash package")
+        return getattr(xxhash, algorithm)()
+    return hashlib.new(algorithm)
+
+
+_buffers = threading.local()
+
+@instrument.timed("folder_tree.hash_file")
+def hash_file(f_path, algorithm: str="sha256", buffer_size: int=1 << 20):
+    """Hash the whole file, reading it into a per-thread reused buffer"""
+    buf = getattr(_buffers, 'buf', None)
+    if buf is None or len(buf) != buffer_size:
+        buf = _buffers.buf = bytearray(buffer_size)
+    view = memoryview(buf)
+    size = 0
+    with open(f_path, 'rb', buffering=0) as f:
+        m = new_hasher(algorithm, os.fstat(f.fileno()).st_size)
+        while True:
+            n = f.readinto(buf)
+            if not n:
+                break
+            m.update(view[:n])
+            size += n
+    instrument.count("folder_tree.hash_file", files=1, size=size)
     return m.hexdigest()
 
 
@@ -93,28 +277,139 @@ def tree_as_dict(folder_tree):
     node_dict = {}
     for node in folder_tree.all_nodes():
         str_path = str(get_relative_path(folder_tree, node))
-        hash_vale = node.data.hash
-        node_dict[str_path] = hash_vale
+        node_dict[str_path] = node
     return node_dict
 
 
+def shape_signatures(folder_tree):
+    """
+    Signature of every node built from file sizes and the directory layout
+    only. Nodes with different signatures can not have the same hash, so
+    this is a free pre-filter before reading any file.
+    """
+    signatures = {}
+    for node in post_order(folder_tree, [folder_tree.root]):
+        signatures[node.identifier] = shape_signature(
+            node, folder_tree.children(node.identifier), signatures)
+    return signatures
+
+
+def shape_signature(node, children: list, signatures: dict):
+    """The signature of a node, given the ones of its children"""
+    if children:
+        return hash(('dir',) + tuple(
+            signatures[child.identifier] for child in children))
+    if is_file_node(node):
+        return hash(('file', node_entry(node).size))
+    return hash(('empty',))
+
+
+class TreeIndex(object):
+    """
+    The nodes of a folder tree by relative path, with their shape
+    signatures. The tree can be patched through it as files change,
+    which keeps both up to date without going over the whole tree again.
+    """
+    def __init__(self, folder_tree):
+        self.tree = folder_tree
+        self.nodes = tree_as_dict(folder_tree)
+        self.shapes = shape_signatures(folder_tree)
+
+    def add(self, entry):
+        """
+        Add a node for an inventory entry below its parent directory,
+        in name order like parse() does. Return its identifier.
+        """
+        parent = self.nodes[os.path.dirname(entry.rel_path) or '.']
+        nid = self.tree.create_node(entry.name, parent=parent.identifier,
+            data=Node_data(None, None, entry), sort=True)
+        self.nodes[entry.rel_path] = self.tree.get_node(nid)
+        return nid
+
+    def remove(self, rel_path: str):
+        """Remove the node at rel_path and its subtree, return its parent's id"""
+        node = self.nodes[rel_path]
+        for sub_node in post_order(self.tree, [node.identifier]):
+            del self.nodes[get_relative_path(self.tree, sub_node)]
+            self.shapes.pop(sub_node.identifier, None)
+        parent_id = self.tree.identifier_of(self.tree.parent[node.index])
+        self.tree.remove_node(node.identifier)
+        return parent_id
+
+    def update(self, node_ids):
+        """
+        Bring nodes and their ancestors up to date once their subtree
+        changed: their hash is cleared, their empty directory flag and
+        shape signature are computed again from their children.
+        """
+        indexes = set()
+        for nid in node_ids:
+            for index in reversed(self.tree.ancestry(self.tree.index(nid))):
+                if index in indexes:
+                    break
+                indexes.add(index)
+        nodes = sorted((self.tree.get_node(self.tree.identifier_of(index))
+                        for index in indexes),
+                       key=lambda node: node_entry(node).depth, reverse=True)
+        for node in nodes:
+            children = self.tree.children(node.identifier)
+            node.data.hash = None
+            mark_empty_dir(node, children)
+            self.shapes[node.identifier] = shape_signature(
+                node, children, self.shapes)
+
+
 def scan_empty_dirs(folder_tree):
+    """
+    Report empty directories without a keep marker (eg. .gitkeep) below them.
+    Both flags come from the parse, no file system call is made here.
+    """
     for node in folder_tree.all_nodes():
-        if node.data.is_empty_dir:
+        if node.data.is_empty_dir and not node_entry(node).has_keep_marker:
             path_name = get_relative_path(folder_tree, node)
-            if list(node.identifier.glob("**/.gitkeep")):
-                pass
-            else:
-                logging.error(f'Found a empty directory: {path_name}')
+            logging.error(f'Found a empty directory: {path_name}')
 
 
 def get_relative_path(folder_tree, node):
-    return node.identifier.relative_to(folder_tree.root)
+    return node_entry(node).rel_path
+
+
+def scan_holdover_items(
+    matser_folder_tree, template_folder_tree,
+    cache: HashCache=None, options: HashOptions=None, paths: set=None,
+    master_index: TreeIndex=None, template_index: TreeIndex=None,
+    ):
+    """
+    Report master items identical to the template item at the same path.
+    Both trees are joined on relative path first and compared by size and
+    layout, only the pairs that still match are hashed.
+    When paths is given, only those paths and their parent directories
+    are checked. Pass the TreeIndex of a tree to reuse it between calls.
+    """
+    master_index = master_index or TreeIndex(matser_folder_tree)
+    template_index = template_index or TreeIndex(template_folder_tree)
+    template_folder_dict = template_index.nodes
+    matser_shapes = master_index.shapes
+    template_shapes = template_index.shapes
+
+    candidates = []
+    for node in matser_folder_tree.all_nodes():
+        str_path = str(get_relative_path(matser_folder_tree, node))
+        template_node = template_folder_dict.get(str_path)
+        if template_node is None:
+            continue
+        if paths is not None and str_path not in paths:
+            continue
+        if matser_shapes[node.identifier] != template_shapes[template_node.identifier]:
+            continue
+        candidates.append((str_path, node, template_node))
 
+    hash_subtrees(matser_folder_tree,
+        [node.identifier for _, node, _ in candidates], cache, options)
+    hash_subtrees(template_folder_tree,
+        [template_node.identifier for _, _, template_node in candidates],
+        cache, options)
 
-def scan_holdover_items(matser_folder_tree, template_folder_tree):
-    matser_folder_dict = tree_as_dict(matser_folder_tree)
-    template_folder_dict = tree_as_dict(template_folder_tree)
-    for str_path, hash_value in matser_folder_dict.items():
-        if hash_value == template_folder_dict.get(str_path, 'None'):
-            logging.error(f'Found a holdover item from template : {str_path}')
\ No newline at end of file
+    for str_path, node, template_node in candidates:
+        if node.data.hash == template_node.data.hash:
+            logging.error(f'Found a holdover item from template : {str_path}')
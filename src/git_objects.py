@@ -0,0 +1,46 @@
+import os
+import subprocess
+from pathlib import Path
+
+# hash_algorithm value that makes file digests git blob object IDs
+GIT_ALGORITHM = "git"
+# Regular files; symlinks and submodules are hashed from the work tree
+BLOB_MODES = {"100644", "100755"}
+
+
+def blob_header(size: int):
+    """The header git hashes in front of the content of a blob"""
+    return b"blob %d\0" % size
+
+
+def git_z(repo_root: Path, *args):
+    """Run a local git command in repo_root and split its NUL separated output"""
+    result = subprocess.run(
+        ["git", "-C", str(repo_root)] + list(args),
+        stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, check=True)
+    return [item.decode('utf-8', 'surrogateescape')
+            for item in result.stdout.split(b'\0') if item]
+
+
+def tracked_blobs(repo_root: Path):
+    """
+    Blob OIDs of the tracked files under repo_root whose work tree copy
+    still matches the index, keyed on path relative to repo_root.
+    Only the index is read, no file content. Modified files are left out,
+    and the result is empty if repo_root is not in a git work tree.
+    """
+    try:
+        staged = git_z(repo_root, "ls-files", "--stage", "-z")
+        modified = set(git_z(
+            repo_root, "diff-files", "--name-only", "--relative", "-z"))
+    except (OSError, subprocess.CalledProcessError):
+        return {}
+
+    blobs = {}
+    for record in staged:
+        info, path = record.split('\t', 1)
+        mode, oid, stage = info.split(' ')
+        # Conflicted files have stages 1-3 and no single blob
+        if mode in BLOB_MODES and stage == "0" and path not in modified:
+            blobs[os.path.normpath(path)] = oid
+    return blobs
@@ -0,0 +1,137 @@
+import os
+import time
+import sqlite3
+import threading
+from pathlib import Path
+
+DEFAULT_CACHE = {
+    "path": ".pre_release_cache/hash_cache.sqlite",
+    "max_entries": 1000000,
+    "max_age_days": 30,
+}
+
+# Files modified this close to the hashing time may change again within the
+# same mtime tick, so they are not cached (same idea as git's racy-clean check)
+RACY_WINDOW_NS = 2 * 10**9
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS hashes (
+    path TEXT NOT NULL,
+    algorithm TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    inode INTEGER NOT NULL,
+    digest TEXT NOT NULL,
+    last_used INTEGER NOT NULL,
+    PRIMARY KEY (path, algorithm)
+)
+"""
+
+
+class HashCache(object):
+    """
+    On-disk content digest cache keyed on (path, size, mtime, inode).
+    The whole table is read once when opened and changes are written back
+    in one transaction on close, so a corrupt or half-written cache is
+    never trusted. Without a db_path the cache only lives in memory.
+    """
+    def __init__(self, db_path=None, max_entries: int=DEFAULT_CACHE["max_entries"],
+                 max_age_days: int=DEFAULT_CACHE["max_age_days"]):
+        self.db_path = Path(db_path) if db_path else None
+        self.max_entries = max_entries
+        self.max_age_days = max_age_days
+        self.records = {}
+        self.updates = {}
+        self.hits = set()
+        self.lock = threading.Lock()
+        self.now = int(time.time())
+        self.load()
+
+    def load(self):
+        if self.db_path is None or not self.db_path.is_file():
+            return
+        try:
+            conn = sqlite3.connect(str(self.db_path))
+            try:
+                rows = conn.execute(
+                    "SELECT path, algorithm, size, mtime_ns, inode, digest "
+                    "FROM hashes").fetchall()
+            finally:
+                conn.close()
+        except sqlite3.DatabaseError:
+            print(f"Discarding the unreadable hash cache {self.db_path}")
+            self.db_path.unlink()
+            return
+        for path, algorithm, size, mtime_ns, inode, digest in rows:
+            self.records[(path, algorithm)] = (size, mtime_ns, inode, digest)
+
+    def tick(self):
+        """Move the clock forward, for caches kept open for a long time"""
+        self.now = int(time.time())
+
+    def get(self, entry, algorithm: str="sha256"):
+        """Return the cached digest of an inventory Entry, or None if stale"""
+        key = (os.path.abspath(entry.path), algorithm)
+        record = self.records.get(key)
+        if record is None or \
+           record[:3] != (entry.size, entry.mtime_ns, entry.inode):
+            return None
+        with self.lock:
+            self.hits.add(key)
+        return record[3]
+
+    def put(self, entry, digest: str, algorithm: str="sha256"):
+        if self.now * 10**9 - entry.mtime_ns < RACY_WINDOW_NS:
+            return
+        key = (os.path.abspath(entry.path), algorithm)
+        record = (entry.size, entry.mtime_ns, entry.inode, digest)
+        with self.lock:
+            self.records[key] = record
+            self.updates[key] = record
+
+    def close(self):
+        """Write new digests back and evict old entries"""
+        if self.db_path is None or (not self.updates and not self.hits):
+            return
+        try:
+            self.db_path.parent.mkdir(parents=True, exist_ok=True)
+            conn = sqlite3.connect(str(self.db_path))
+            try:
+                with conn:
+                    self.write(conn)
+            finally:
+                conn.close()
+        except (sqlite3.DatabaseError, OSError) as e:
+            print(f"Failed to update the hash cache {self.db_path}: {e}")
+
+    def write(self, conn):
+        conn.execute(SCHEMA)
+        conn.executemany(
+            "INSERT OR REPLACE INTO hashes VALUES (?, ?, ?, ?, ?, ?, ?)",
+            [(path, algorithm) + record + (self.now,)
+             for (path, algorithm), record in self.updates.items()])
+        conn.executemany(
+            "UPDATE hashes SET last_used = ? WHERE path = ? AND algorithm = ?",
+            [(self.now, path, algorithm)
+             for path, algorithm in self.hits - set(self.updates)])
+        # Evict entries that have not been used for a while, then the
+        # least recently used ones above the size limit
+        conn.execute(
+            "DELETE FROM hashes WHERE last_used < ?",
+            (self.now - self.max_age_days * 86400,))
+        conn.execute(
+            "DELETE FROM hashes WHERE rowid IN (SELECT rowid FROM hashes "
+            "ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+            (self.max_entries,))
+
+
+def open_cache(config: dict):
+    """Open the hash cache configured under folder_analysis, if enabled"""
+    settings = config['folder_analysis'].get('hash_cache', DEFAULT_CACHE)
+    if not settings:
+        return None
+    settings = dict(DEFAULT_CACHE, **settings)
+    return HashCache(
+        settings["path"],
+        max_entries=settings["max_entries"],
+        max_age_days=settings["max_age_days"])
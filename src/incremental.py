@@ -0,0 +1,45 @@
+import os
+import subprocess
+from pathlib import Path
+
+
+def git(repo_root: Path, *args):
+    """Run a local git command in repo_root and return its stdout lines"""
+    result = subprocess.run(
+        ["git", "-C", str(repo_root)] + list(args),
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+        universal_newlines=True, check=True)
+    return [line for line in result.stdout.splitlines() if line]
+
+
+def changed_paths(repo_root: Path, base_ref: str):
+    """
+    Paths (relative to repo_root) changed since base_ref, including
+    uncommitted and untracked files. Only local git objects are read.
+    Return None if the base can not be resolved, to fall back to a full scan.
+    """
+    try:
+        base = git(repo_root, "rev-parse", "--verify", "--quiet",
+                   f"{base_ref}^{{commit}}")[0]
+        paths = git(repo_root, "diff", "--name-only", "--no-renames", base)
+        paths += git(repo_root, "ls-files", "--others", "--exclude-standard")
+    except (OSError, IndexError, subprocess.CalledProcessError):
+        print(f"Can not resolve {base_ref} in {repo_root}, "
+              "checking every file instead")
+        return None
+    return set(os.path.normpath(path) for path in paths)
+
+
+def read_paths(values: list):
+    """Normalise a list of changed paths given on the command line"""
+    return set(os.path.normpath(value) for value in values)
+
+
+def with_ancestors(paths: set):
+    """The paths plus every directory containing one of them"""
+    expanded = set()
+    for path in paths:
+        while path and path not in expanded:
+            expanded.add(path)
+            path = os.path.dirname(path)
+    return expanded
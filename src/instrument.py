@@ -0,0 +1,147 @@
+import json
+import time
+import resource
+import threading
+import functools
+from contextlib import contextmanager
+
+_lock = threading.Lock()
+_local = threading.local()
+_stats = {"stages": {}, "functions": {}}
+_profiles = []
+# Set to True to profile every stage with cProfile
+profiling = False
+
+
+def peak_rss_kb():
+    """Peak resident memory of the process so far (KB on Linux)"""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def _record(kind: str, name: str, wall_time: float=0.0,
+            files: int=0, size: int=0, calls: int=1):
+    with _lock:
+        stats = _stats[kind].get(name)
+        if stats is None:
+            stats = _stats[kind][name] = {
+                "calls": 0, "wall_time": 0.0, "files": 0, "bytes": 0}
+        stats["calls"] += calls
+        stats["wall_time"] += wall_time
+        stats["files"] += files
+        stats["bytes"] += size
+        if kind == "stages" and calls:
+            stats["peak_rss_kb"] = peak_rss_kb()
+
+
+def current_stage():
+    """The stage running in this thread, or None"""
+    return getattr(_local, 'stage', None)
+
+
+def count(name: str, files: int=0, size: int=0):
+    """
+    Add processed files and bytes to a function's counters, and to the
+    ones of the stage running it
+    """
+    _record("functions", name, files=files, size=size, calls=0)
+    stage_name = current_stage()
+    if stage_name is not None:
+        _record("stages", stage_name, files=files, size=size, calls=0)
+
+
+def _call_in_stage(stage_name, func, *args, **kwargs):
+    previous = current_stage()
+    _local.stage = stage_name
+    try:
+        return func(*args, **kwargs)
+    finally:
+        _local.stage = previous
+
+
+def bind(func):
+    """
+    Wrap func so it counts towards the current stage when a worker pool
+    runs it in another thread
+    """
+    return functools.partial(_call_in_stage, current_stage(), func)
+
+
+def timed(name: str):
+    """Decorator adding the wall time of every call to a function's counters"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                _record("functions", name, time.perf_counter() - start)
+        return wrapper
+    return decorator
+
+
+@contextmanager
+def stage(name: str):
+    """
+    Time a check stage and record the process memory peak at its end.
+    The files and bytes counted meanwhile in this thread (or by functions
+    wrapped with bind) add up in the stage's counters.
+    The stage is profiled too when profiling is on.
+    """
+    if profiling:
+        import cProfile
+        profile = cProfile.Profile()
+    else:
+        profile = None
+    previous = current_stage()
+    _local.stage = name
+    start = time.perf_counter()
+    if profile is not None:
+        try:
+            profile.enable()
+        except ValueError:
+            # Another profiler is already active (eg. repos checked in
+            # parallel on Python 3.12+), leave this stage out of the profile
+            profile = None
+    try:
+        yield
+    finally:
+        _local.stage = previous
+        if profile is not None:
+            profile.disable()
+            with _lock:
+                _profiles.append(profile)
+        _record("stages", name, time.perf_counter() - start)
+
+
+def reset():
+    global _stats
+    with _lock:
+        _stats = {"stages": {}, "functions": {}}
+        del _profiles[:]
+
+
+def report():
+    with _lock:
+        return json.loads(json.dumps(_stats))
+
+
+def write_report(f_name):
+    """Write the timings as JSON, apart from the pass/fail log"""
+    data = report()
+    data["peak_rss_kb"] = peak_rss_kb()
+    with open(f_name, 'w') as f:
+        json.dump(data, f, indent=2, sort_keys=True)
+
+
+def write_profile(f_name):
+    """Merge the stage profiles into one pstats dump"""
+    with _lock:
+        profiles = list(_profiles)
+    if not profiles:
+        return
+    import pstats
+    stats = pstats.Stats(profiles[0])
+    for profile in profiles[1:]:
+        stats.add(profile)
+    stats.dump_stats(f_name)
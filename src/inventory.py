@@ -0,0 +1,233 @@
+import os
+from stat import S_ISDIR
+from pathlib import Path
+from src.exclusions import ExclusionRules, is_ignored, load_ignores
+from src import instrument
+
+
+class Entry(object):
+    """
+    A file or directory found by the inventory walk, with cached stat data
+    has_keep_marker is set on a directory containing a keep marker file
+    (eg. .gitkeep) anywhere below it, even if the marker itself is excluded.
+    hidden is set below a name starting with a dot (left out of the syntax
+    check), excluded below a name matching the exclude_filenames/
+    exclude_paths rules (left out of the folder tree).
+    """
+    __slots__ = (
+        'path', 'rel_path', 'name', 'parent', 'depth',
+        'is_dir', 'size', 'mtime_ns', 'inode', 'has_keep_marker',
+        'hidden', 'excluded',
+    )
+
+    def __init__(self, path, rel_path, name, parent, depth, is_dir,
+                 size=0, mtime_ns=0, inode=0):
+        self.path = path
+        self.rel_path = rel_path
+        self.name = name
+        self.parent = parent
+        self.depth = depth
+        self.is_dir = is_dir
+        self.size = size
+        self.mtime_ns = mtime_ns
+        self.inode = inode
+        self.has_keep_marker = False
+        self.hidden = False
+        self.excluded = False
+
+
+class Inventory(object):
+    """
+    Flat listing of a directory tree.
+    Entries are kept in depth-first pre-order with every directory
+    listing sorted by name, which is the order the folder tree is built in.
+    """
+    def __init__(self, root: Path):
+        self.root = Path(root)
+        self.root_entry = Entry(str(self.root), '.', '.', None, 0, True)
+        self.entries = []
+
+    def add(self, entry: Entry):
+        self.entries.append(entry)
+
+    def files(self):
+        return [e for e in self.entries if not e.is_dir]
+
+    def subset(self, rel_paths: set):
+        """A new Inventory holding only the entries at the given paths"""
+        inventory = Inventory(self.root)
+        inventory.root_entry = self.root_entry
+        for entry in self.entries:
+            if entry.rel_path in rel_paths:
+                inventory.add(entry)
+        return inventory
+
+    def replace(self, removed: set, entries: list):
+        """
+        Drop the entries at or below the removed paths and add new ones,
+        keeping the walk order. Return the dropped entries.
+        """
+        dropped = []
+        if removed:
+            prefixes = tuple(rel_path + os.sep for rel_path in removed)
+            kept = []
+            for entry in self.entries:
+                if entry.rel_path in removed or \
+                   entry.rel_path.startswith(prefixes):
+                    dropped.append(entry)
+                else:
+                    kept.append(entry)
+            self.entries = kept
+        if entries:
+            self.entries.extend(entries)
+            # Pre-order with sorted listings is the order of the path parts
+            self.entries.sort(key=lambda entry: entry.rel_path.split(os.sep))
+        return dropped
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __iter__(self):
+        return iter(self.entries)
+
+
+@instrument.timed("inventory.scan")
+def scan(root_path: Path, config: dict):
+    """
+    Walk a directory once with os.scandir and build an Inventory.
+    Entries are flagged hidden and excluded (see Entry) while walking, and
+    the ones both hidden and excluded (eg. .git) are never descended into,
+    as no check looks at them. With use_gitignore, the .gitignore files
+    found along the way are applied too.
+    Keep markers are rolled up to every enclosing directory in the same pass.
+    """
+    walker = Walker(config)
+    inventory = Inventory(root_path)
+    walker.walk(inventory, inventory.root_entry, '',
+                walker.dir_ignores(inventory.root, '.'))
+    instrument.count("inventory.scan", files=len(inventory.entries))
+    return inventory
+
+
+class Walker(object):
+    """The walk settings of scan(), also used to walk a part of the tree again"""
+    def __init__(self, config: dict):
+        self.rules = ExclusionRules.from_config(config)
+        self.use_gitignore = config['folder_analysis'].get('use_gitignore', False)
+        self.keep_markers = set(
+            config['folder_analysis'].get('keep_markers', {'.gitkeep'}))
+
+    def dir_ignores(self, root: Path, dir_rel_path: str):
+        """The .gitignore files in effect inside a directory below root"""
+        if not self.use_gitignore:
+            return ()
+        root = str(root)
+        ignores = load_ignores(root, '', ())
+        rel_path = ''
+        for name in os.path.normpath(dir_rel_path).split(os.sep):
+            if name == '.':
+                continue
+            rel_path = os.path.join(rel_path, name)
+            ignores = load_ignores(os.path.join(root, rel_path), rel_path, ignores)
+        return ignores
+
+    def flags(self, name: str, path: str, parent: Entry):
+        """The hidden and excluded flags of a path in the parent directory"""
+        return (parent.hidden or name.startswith('.'),
+                parent.excluded or self.rules.excludes(name, path))
+
+    def entry(self, root: Path, rel_path: str, parent: Entry):
+        """
+        A fresh Entry for one path below root, or None if it is missing,
+        left out of the walk or ignored.
+        """
+        path = os.path.join(str(root), rel_path)
+        name = os.path.basename(rel_path)
+        hidden, excluded = self.flags(name, path, parent)
+        if hidden and excluded:
+            return None
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        is_dir = S_ISDIR(stat.st_mode)
+        ignores = self.dir_ignores(root, os.path.dirname(rel_path))
+        if ignores and is_ignored(ignores, rel_path, is_dir):
+            return None
+        entry = Entry(
+            path, rel_path, name, os.path.dirname(path),
+            rel_path.count(os.sep) + 1,
+            is_dir, stat.st_size, stat.st_mtime_ns, stat.st_ino)
+        entry.hidden, entry.excluded = hidden, excluded
+        return entry
+
+    def walk(self, inventory: Inventory, dir_entry: Entry, dir_rel_path: str,
+             ignores: tuple):
+        """Add the entries below a directory to the inventory, in pre-order"""
+        # Stack of (sorted listing iterator, directory entry, relative dir
+        # path, depth, ignores, (device, inode)); a directory's listing is
+        # pushed as soon as it is met, giving pre-order
+        stack = [(_list_dir(dir_entry.path), dir_entry, dir_rel_path,
+                  dir_entry.depth, ignores, dir_key(dir_entry.path))]
+        while stack:
+            listing, parent, dir_rel_path, depth, ignores, _ = stack[-1]
+            dir_entry = next(listing, None)
+            if dir_entry is None:
+                stack.pop()
+                continue
+            if dir_entry.name in self.keep_markers and not parent.excluded:
+                mark_keep_marker(stack)
+            hidden, excluded = self.flags(dir_entry.name, dir_entry.path, parent)
+            if hidden and excluded:
+                continue
+            try:
+                is_dir = dir_entry.is_dir()
+                stat = dir_entry.stat()
+            except OSError:
+                continue
+            rel_path = os.path.join(dir_rel_path, dir_entry.name)
+            if ignores and is_ignored(ignores, rel_path, is_dir):
+                continue
+            entry = Entry(
+                dir_entry.path, rel_path, dir_entry.name,
+                os.path.dirname(dir_entry.path), depth + 1,
+                is_dir, stat.st_size, stat.st_mtime_ns, stat.st_ino)
+            entry.hidden, entry.excluded = hidden, excluded
+            inventory.add(entry)
+            if is_dir:
+                # Guard against symlink loops: a directory is not entered
+                # again below itself, other links to it are walked
+                key = (stat.st_dev, stat.st_ino)
+                if all(frame[5] != key for frame in stack):
+                    if self.use_gitignore:
+                        sub_ignores = load_ignores(
+                            dir_entry.path, rel_path, ignores)
+                    else:
+                        sub_ignores = ignores
+                    stack.append((_list_dir(dir_entry.path), entry, rel_path,
+                                  depth + 1, sub_ignores, key))
+
+
+def dir_key(dir_path: str):
+    try:
+        stat = os.stat(dir_path)
+    except OSError:
+        return None
+    return (stat.st_dev, stat.st_ino)
+
+
+def mark_keep_marker(stack: list):
+    """Flag the directories on the walk stack, stopping at one already flagged"""
+    for frame in reversed(stack):
+        dir_entry = frame[1]
+        if dir_entry.has_keep_marker:
+            break
+        dir_entry.has_keep_marker = True
+
+
+def _list_dir(dir_path: str):
+    try:
+        with os.scandir(dir_path) as it:
+            return iter(sorted(it, key=lambda _e: _e.name))
+    except OSError:
+        return iter(())
@@ -0,0 +1,42 @@
+import logging
+import threading
+from contextlib import contextmanager
+
+_local = threading.local()
+
+
+class CaptureFilter(logging.Filter):
+    """Divert root logger records to the capture list of the current thread"""
+    def filter(self, record):
+        records = getattr(_local, 'records', None)
+        if records is None:
+            return True
+        records.append(record)
+        return False
+
+
+_capture_filter = CaptureFilter()
+
+
+@contextmanager
+def capture_records():
+    """
+    Collect the records logged on the root logger by the current thread
+    instead of emitting them, so they can be replayed in a fixed order.
+    """
+    root = logging.getLogger()
+    if _capture_filter not in root.filters:
+        root.addFilter(_capture_filter)
+    previous = getattr(_local, 'records', None)
+    _local.records = []
+    try:
+        yield _local.records
+    finally:
+        _local.records = previous
+
+
+def replay(records: list):
+    """Emit captured records from the current thread"""
+    root = logging.getLogger()
+    for record in records:
+        root.handle(record)
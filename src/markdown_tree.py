@@ -3,24 +3,29 @@ import hashlib
 from pathlib import Path
 from itertools import islice
 from functools import partial
-from treelib import tree
+from src.compact_tree import Tree
 import logging
 import src.utils as utils
+from src import instrument
 
 
-def parse(f_path: Path, show: bool=False):
+@instrument.timed("markdown_tree.parse")
+def parse(readme, show: bool=False):
     """
-    Given a markdown file path to parse a doc tree
+    Given a ReadmeDocument (or a markdown file path) to parse a doc tree
     The file's hierarchy is determined by heading hierarchy.
     eg. `# `, `## ` and `### ` etc
     """
+    if not isinstance(readme, ReadmeDocument):
+        readme = ReadmeDocument.read(readme)
+
     # Use line 0 as root
-    text_tree = tree.Tree()
+    text_tree = Tree()
     text_tree.create_node('Root', 0, data=Node_data('# 0. Root'))  # root node
 
     # Find the lowerest heading level
-    markdown_contents = [Node_data(line) for line in utils.read_file(f_path)]
-    max_level = max([node_data.level for node_data in markdown_contents])
+    markdown_contents = readme.line_data
+    max_level = readme.max_level()
 
     if max_level == 0 :
         # Case of no heading found
@@ -55,6 +60,8 @@ IS_HEADING = re.compile(r"^\#*\s")
 FIND_NUMBER = re.compile(r"^[\d+\.]+[\d+|\d+\.](?=\s)")
 
 class Node_data(object):
+    __slots__ = ('level', 'number', 'clean_text', 'is_heading', 'raw_text')
+
     def __init__(self, text):
         self.level= -1
         self.number = None
@@ -84,6 +91,76 @@ class Node_data(object):
             self.clean_text = text
 
 
+class Heading(object):
+    """A heading line and the span of its section, heading included"""
+    __slots__ = ('line_no', 'level', 'text', 'end_line')
+
+    def __init__(self, line_no, level, text, end_line=None):
+        self.line_no = line_no
+        self.level = level
+        self.text = text
+        self.end_line = end_line
+
+
+class ReadmeDocument(object):
+    """
+    A README file read once.
+    Keeps the raw lines, the parsed line data and an index of the headings
+    with the line span of each section, so callers can slice sections by
+    line range without going through a tree.
+    """
+    def __init__(self, path, raw_lines: list):
+        self.path = Path(path)
+        self.raw_lines = raw_lines
+        self.line_data = [Node_data(line.strip()) for line in raw_lines]
+        self.headings = self.index_headings()
+
+    @classmethod
+    def read(cls, path):
+        with open(path, 'r') as f:
+            return cls(path, f.readlines())
+
+    def __len__(self):
+        return len(self.raw_lines)
+
+    def max_level(self):
+        return max([node_data.level for node_data in self.line_data], default=0)
+
+    def index_headings(self):
+        """A section ends right before the next heading of the same or a higher level"""
+        headings = []
+        open_headings = []
+        for line_no, node_data in enumerate(self.line_data, 1):
+            if not node_data.is_heading:
+                continue
+            while open_headings and open_headings[-1].level >= node_data.level:
+                open_headings.pop().end_line = line_no - 1
+            heading = Heading(line_no, node_data.level, node_data.clean_text)
+            headings.append(heading)
+            open_headings.append(heading)
+        for heading in open_headings:
+            heading.end_line = len(self.raw_lines)
+        return headings
+
+    def find_heading(self, text: str):
+        """First heading whose text matches, ignoring the case"""
+        for heading in self.headings:
+            if heading.text.lower() == text.lower():
+                return heading
+        return None
+
+    def lines(self, start_line: int, end_line: int):
+        """Raw (line no, line) pairs of a 1-based inclusive line range"""
+        return [(i, self.raw_lines[i-1]) for i in range(start_line, end_line+1)]
+
+    def section(self, text: str):
+        """Raw lines of the section under a heading, the heading included"""
+        heading = self.find_heading(text)
+        if heading is None:
+            return None
+        return self.lines(heading.line_no, heading.end_line)
+
+
 def check_heading_number(tree, config):
     """Check if a heading is number"""
     unnumbered_heading = set(config['readme']["unnumbered_heading"])
@@ -137,7 +214,90 @@ def line_texts(nodes):
             node_texts[node.identifier] = node.tag
     return node_texts
 
+
+class LineIndex(object):
+    """The lines of a README keyed on line number, with a set of their texts"""
+    def __init__(self, lines: dict):
+        self.lines = lines
+        self.texts = set(lines.values())
+
+    def __contains__(self, text):
+        return text in self.texts
+
+
+class TemplateLines(object):
+    """
+    What check_readme needs from the template README: the text of every
+    text line keyed on line number, and the mandatory line texts with
+    their line numbers
+    """
+    def __init__(self, lines: dict, mandatory_lines: dict):
+        self.lines = lines
+        self.mandatory_lines = mandatory_lines
+
+    @classmethod
+    def from_tree(cls, template_readme, config):
+        mandatory_lines = utils.parser_line_no(config['readme']['mandatory_lines'])
+        return cls(
+            line_texts(list(template_readme.filter_nodes(is_text))),
+            {template_readme.get_node(i).tag: i for i in mandatory_lines})
+
+
+NON_WORD = re.compile(r"[^\w\s]")
+
+def normalize_line(text):
+    """Lower case words only, so case/spacing/punctuation edits still match"""
+    return NON_WORD.sub(" ", text.lower()).split()
+
+
+def shingles(text, size: int=3):
+    """Hashes of the word n-grams of a line"""
+    words = normalize_line(text)
+    if len(words) <= size:
+        return {hash(tuple(words))} if words else set()
+    return {hash(tuple(words[i:i + size])) for i in range(len(words) - size + 1)}
+
+
+class ShingleIndex(object):
+    """
+    Inverted index from line shingles to line numbers.
+    Finding the lines similar to a given one only touches the lines sharing
+    at least one shingle with it, instead of comparing all pairs.
+    """
+    def __init__(self, lines: dict, size: int=3):
+        self.size = size
+        self.shingles = {}
+        self.postings = {}
+        for line_no, text in lines.items():
+            line_shingles = shingles(text, size)
+            self.shingles[line_no] = line_shingles
+            for shingle in line_shingles:
+                self.postings.setdefault(shingle, []).append(line_no)
+
+    def best_match(self, text, threshold: float=0.8):
+        """Return (line no, similarity) of the most similar line or None"""
+        line_shingles = shingles(text, self.size)
+        shared = {}
+        for shingle in line_shingles:
+            for line_no in self.postings.get(shingle, ()):
+                shared[line_no] = shared.get(line_no, 0) + 1
+        best = None
+        for line_no, count in shared.items():
+            # Jaccard similarity of the two shingle sets
+            similarity = count / (
+                len(line_shingles) + len(self.shingles[line_no]) - count)
+            if similarity >= threshold and (best is None or similarity > best[1]):
+                best = (line_no, similarity)
+        return best
+
+
 def check_readme(master_readme, template_readme, config):
+    """
+    Check the README tree of master against the template README, given
+    as a tree or as TemplateLines (eg. from the template fingerprint)
+    """
+    if not isinstance(template_readme, TemplateLines):
+        template_readme = TemplateLines.from_tree(template_readme, config)
     check_heading_number(master_readme, config)
     check_heading_order(master_readme, config)
     # Check mandatory sections
@@ -154,22 +314,42 @@ def check_readme(master_readme, template_readme, config):
             logging.error(f"Missing a mandatory section in README.md: {heading}")
 
     # Check mandatory texts
-    mandatory_lines = utils.parser_line_no(config['readme']['mandatory_lines'])
-    mandatory_lines = {template_readme.get_node(i).tag: i for i in mandatory_lines}
+    mandatory_lines = template_readme.mandatory_lines
     master_text = line_texts(list(master_readme.filter_nodes(is_text)))
+    master_index = LineIndex(master_text)
     
     for line, i in mandatory_lines.items():
-        if line not in set(master_text.values()):
+        if line not in master_index:
             logging.error(f"Missing a mandatory line in README.md: L{i} :{line}")
 
     # Check duplicate texts
-    template_text = line_texts(list(template_readme.filter_nodes(is_text)))
+    template_text = template_readme.lines
     ignore_lines = utils.parser_line_no(config['readme']['ignore_lines'])
     reduce_template_text = {i:line for i, line in template_text.items() if i not in ignore_lines}
+    template_index = LineIndex(reduce_template_text)
     for i, line in master_text.items():
-        if line in set(reduce_template_text.values()):
+        if line in template_index:
             if line in mandatory_lines:
                 pass
             else:
                 logging.error(f"Find a exact line from template README.md: L{i} :{line}")
 
+    fuzzy_match = config['readme'].get('fuzzy_match') or {}
+    if fuzzy_match.get('enabled'):
+        check_near_copies(master_index, template_index, mandatory_lines, fuzzy_match)
+
+
+def check_near_copies(master_index, template_index, mandatory_lines, settings):
+    """Report master lines that are close, but not equal, to a template line"""
+    shingle_index = ShingleIndex(
+        {i: line for i, line in template_index.lines.items()
+         if line not in mandatory_lines},
+        settings.get('shingle_size', 3))
+    threshold = settings.get('threshold', 0.8)
+    for i, line in master_index.lines.items():
+        if line in template_index or line in mandatory_lines:
+            continue
+        match = shingle_index.best_match(line, threshold)
+        if match:
+            logging.warning(
+                f"Find a near copy of template README.md L{match[0]}: L{i} :{line}")
@@ -1,34 +1,76 @@
-import hashlib
+import os
 import logging
 from pathlib import Path
+from src.inventory import Entry
+from src.hash_cache import HashCache
+from src.folder_tree import new_hasher
 
-def hash_file(f_path):
-    m = hashlib.md5()
-    with open(f_path, 'rb') as f:
-        m.update(f.read())
-    return m.hexdigest()
 
-def compare_file(f_path1, f_path2):
-    file_1 = hash_file(f_path1)
-    file_2 = hash_file(f_path2)
-    if file_1 == file_2:
-        return True
-    else:
+def stat_entry(f_path: Path):
+    stat = os.stat(f_path)
+    return Entry(str(f_path), f_path.name, f_path.name, str(f_path.parent), 0,
+                 False, stat.st_size, stat.st_mtime_ns, stat.st_ino)
+
+
+def compare_file(f_path1, f_path2, cache: HashCache=None,
+                 algorithm: str="sha256", chunk_size: int=1 << 20):
+    """
+    Return True if both files have the same content.
+    Sizes are compared first, then cached digests, and only then the files
+    are read chunk by chunk, stopping at the first differing chunk.
+    Files found equal get their digests cached, so they are not read again
+    while they stay unchanged.
+    """
+    entry1, entry2 = stat_entry(Path(f_path1)), stat_entry(Path(f_path2))
+    if entry1.size != entry2.size:
         return False
+    if cache is not None:
+        digest1 = cache.get(entry1, algorithm)
+        digest2 = cache.get(entry2, algorithm)
+        if digest1 is not None and digest2 is not None:
+            return digest1 == digest2
+
+    m1 = new_hasher(algorithm, entry1.size)
+    m2 = new_hasher(algorithm, entry2.size)
+    buf1, buf2 = bytearray(chunk_size), bytearray(chunk_size)
+    view1, view2 = memoryview(buf1), memoryview(buf2)
+    with open(f_path1, 'rb') as f1, open(f_path2, 'rb') as f2:
+        while True:
+            n1 = f1.readinto(buf1)
+            n2 = f2.readinto(buf2)
+            if n1 != n2 or view1[:n1] != view2[:n2]:
+                return False
+            if not n1:
+                break
+            m1.update(view1[:n1])
+            m2.update(view2[:n2])
+    if cache is not None:
+        cache.put(entry1, m1.hexdigest(), algorithm)
+        cache.put(entry2, m2.hexdigest(), algorithm)
+    return True
 
 def get_readme_pdf(root):
-    pdfs = root.glob('*.pdf')
-    for pdf in pdfs:
-        if pdf.lower()=="readme.pdf":
+    root = Path(root)
+    if not root.is_dir():
+        return None
+    for pdf in root.iterdir():
+        if pdf.name.lower()=="readme.pdf" and pdf.is_file():
             return pdf
     return None
 
-def compare_readme(root):
+def compare_readme(root, rendered_root=Path('pdf'), cache: HashCache=None,
+                   algorithm: str="sha256"):
+    """
+    Check the README PDF in the repo against the one rendered from
+    README.md into rendered_root
+    """
+    rendered_readme = get_readme_pdf(rendered_root)
+    if rendered_readme is None:
+        print(f"No rendered README PDF in {rendered_root}, skipping the PDF check")
+        return
     new_readme = get_readme_pdf(root)
-    old_readme = get_readme_pdf(Path('pdf'))
-    if old_readme:
-        if compare_file(new_readme, old_readme):
+    if new_readme:
+        if not compare_file(new_readme, rendered_readme, cache, algorithm):
             logging.warning("The main readme PDF is not even with Markdown file")
     else:
         logging.error("Can not find the PDF version of the readme file in the repo")
-    
\ No newline at end of file
@@ -0,0 +1,83 @@
+import logging
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from src.log_capture import capture_records, replay
+from src import instrument
+
+
+class Stage(object):
+    def __init__(self, name: str, func, inputs: tuple=()):
+        self.name = name
+        self.func = func
+        self.inputs = tuple(inputs)
+
+
+class Scheduler(object):
+    """
+    Run a DAG of check stages on a thread pool.
+    A stage is called with the results of its input stages once they are
+    all done, so independent stages run concurrently. A failing stage is
+    logged and only skips the stages depending on it. What every stage
+    logs is held back and emitted in declaration order, so the log does
+    not depend on which stage finishes first.
+    """
+    def __init__(self, workers: int=None):
+        self.workers = workers
+        self.stages = []
+
+    def add(self, name: str, func, inputs: tuple=()):
+        """Declare a stage, its inputs must be declared before it"""
+        known = {stage.name for stage in self.stages}
+        for name_in in inputs:
+            if name_in not in known:
+                raise ValueError(f"Stage {name} depends on unknown stage {name_in}")
+        self.stages.append(Stage(name, func, inputs))
+
+    def run_stage(self, stage: Stage, args: list):
+        with capture_records() as records:
+            # Instrumentation errors stay scoped to the stage too
+            try:
+                with instrument.stage(stage.name):
+                    result = stage.func(*args)
+                failed = False
+            except Exception as e:
+                logging.exception(e)
+                logging.error(f"The {stage.name} stage of the pre-release check failed")
+                result = None
+                failed = True
+        return result, failed, records
+
+    def run(self):
+        """Run every stage and return the results keyed on stage name"""
+        results, failed, logs = {}, set(), {}
+        pending = list(self.stages)
+        running = {}
+        workers = self.workers or max(len(self.stages), 1)
+        if instrument.profiling:
+            # Only one profiler can be active at a time (Python 3.12+)
+            workers = 1
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            while pending or running:
+                for stage in list(pending):
+                    if any(name in failed for name in stage.inputs):
+                        pending.remove(stage)
+                        failed.add(stage.name)
+                        logs[stage.name] = []
+                        print(f"Skipping the {stage.name} stage, an input stage failed")
+                    elif all(name in results for name in stage.inputs):
+                        pending.remove(stage)
+                        args = [results[name] for name in stage.inputs]
+                        running[pool.submit(self.run_stage, stage, args)] = stage
+                if not running:
+                    continue
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    stage = running.pop(future)
+                    result, stage_failed, logs[stage.name] = future.result()
+                    if stage_failed:
+                        failed.add(stage.name)
+                    else:
+                        results[stage.name] = result
+
+        for stage in self.stages:
+            replay(logs.get(stage.name, []))
+        return results
@@ -1,64 +1,226 @@
+import io
+import os
 import re
 import logging
-from pathlib import Path
+from concurrent import futures
+from src.inventory import Inventory, scan
+from src import instrument
 
-def load_file(f_path):
+# Bytes sniffed at the start of a file to tell binary files apart
+BINARY_SNIFF_SIZE = 8192
+DEFAULT_SETTINGS = {
+    # Files larger than this are not scanned, None to scan everything
+    "max_file_size": 10 * 1024 * 1024,
+    # Longer lines are cut, the rest of the line is skipped
+    "max_line_length": 65536,
+    # Files scanned concurrently, None for one worker per CPU
+    "workers": None,
+    # "thread" or "process"
+    "executor": "thread",
+}
+
+
+def is_binary(prefix: bytes):
+    return b"\0" in prefix
+
+
+def iter_lines(f_path, max_line_length: int=DEFAULT_SETTINGS["max_line_length"]):
+    """
+    Lazily yield the stripped lines of a text file.
+    Binary files yield nothing. Memory use is bounded by max_line_length
+    whatever the file size, invalid UTF-8 bytes are replaced.
+    """
     try:
-        with open(f_path, 'r') as f:
-            return [line.strip() for line in f.readlines()]
-    except:
-        return []
-
-def find_pattern(f_path, prog, skip_header=False):
-    matches = []
-    file_header = True if skip_header else False
-    for i, line in enumerate(load_file(f_path), 1):
-        if file_header and line.startswith("#"):
-            continue
-        else: 
+        with open(f_path, 'rb') as raw:
+            if is_binary(raw.peek(BINARY_SNIFF_SIZE)[:BINARY_SNIFF_SIZE]):
+                return
+            # Counted here, where binary files are left out
+            instrument.count("syntax_checker.find_patterns", files=1,
+                size=os.fstat(raw.fileno()).st_size)
+            f = io.TextIOWrapper(raw, encoding='utf-8', errors='replace')
+            while True:
+                line = f.readline(max_line_length)
+                if not line:
+                    break
+                if len(line) == max_line_length and not line.endswith('\n'):
+                    # Drop the rest of an over-long line
+                    rest = line
+                    while len(rest) == max_line_length and \
+                          not rest.endswith('\n'):
+                        rest = f.readline(max_line_length)
+                yield line.strip()
+    except OSError:
+        return
+
+class Rule(object):
+    """
+    A line pattern reported by check_syntax.
+    The pattern is matched at the start of each stripped, lower-cased line.
+    """
+    def __init__(
+        self, name: str, pattern: str, message: str,
+        level: str="error", suffixes: list=None, skip_header: bool=False,
+        ignore_lines: set=None,
+        ):
+        self.name = name
+        self.pattern = pattern
+        self.prog = re.compile(pattern)
+        self.message = message
+        self.level = level
+        self.suffixes = tuple(suffixes) if suffixes else None
+        # Skip the leading comment block of a file (eg. license headers)
+        self.skip_header = skip_header
+        self.ignore_lines = set(ignore_lines or ())
+
+    def applies_to(self, f_path: str):
+        return self.suffixes is None or f_path.endswith(self.suffixes)
+
+
+BUILTIN_RULES = {
+    "todo": {
+        "pattern": r'\#+\s*(todo|to-do|fix-me|fixme)',
+        "message": "Find Unresolved todo at",
+        "level": "error",
+    },
+    "commented_code": {
+        "pattern": r'\#+\s+.*[\+|\-|\*|\/|\(|\=].*',
+        "message": "Find commented code at",
+        "level": "warning",
+        "suffixes": [".py"],
+        "skip_header": True,
+    },
+}
+
+
+def load_rules(config: dict):
+    """
+    Build the rules from BUILTIN_RULES and the optional syntax_rules
+    config section, which can add new rules or override built-in ones.
+    """
+    definitions = {name: dict(rule) for name, rule in BUILTIN_RULES.items()}
+    for name, rule in config.get('syntax_rules', {}).items():
+        definitions[name] = dict(definitions.get(name, {}), **rule)
+    special_lines = config.get('commented_code', {}).get('special_lines', ())
+    definitions["commented_code"].setdefault("ignore_lines", special_lines)
+    return [Rule(name, **rule) for name, rule in definitions.items()]
+
+
+class Scanner(object):
+    """
+    Apply several rules to each file in a single pass.
+    The rules applying to a file are joined in one alternation of named
+    groups. A line that does not match it is rejected with one regex call;
+    on a hit, the matching group tells which rule matched first, and only
+    the rules after it are tried on their own.
+    """
+    def __init__(self, rules: list, settings: dict=DEFAULT_SETTINGS):
+        self.rules = rules
+        self.settings = settings
+        self._combined = {}
+
+    def combined(self, rule_ids: tuple):
+        prog = self._combined.get(rule_ids)
+        if prog is None:
+            prog = re.compile('|'.join(
+                f'(?P<_rule{i}>{self.rules[i].pattern})' for i in rule_ids))
+            self._combined[rule_ids] = prog
+        return prog
+
+    def scan_file(self, f_path: str):
+        """Return the (line no, line) matches of each rule in one file"""
+        return find_patterns(f_path, self, self.settings["max_line_length"])
+
+
+@instrument.timed("syntax_checker.find_patterns")
+def find_patterns(f_path, scanner: Scanner,
+                  max_line_length: int=DEFAULT_SETTINGS["max_line_length"]):
+    rule_ids = tuple(i for i, rule in enumerate(scanner.rules)
+        if rule.applies_to(f_path))
+    matches = {}
+    if not rule_ids:
+        return matches
+    prog = scanner.combined(rule_ids)
+    file_header = True
+    for i, line in enumerate(iter_lines(f_path, max_line_length), 1):
+        if file_header and not line.startswith("#"):
             file_header = False
 
-        if prog.match(line.lower()):
-            matches.append((i, line))
+        lower = line.lower()
+        m = prog.match(lower)
+        if not m:
+            continue
+        first = int(m.lastgroup[len('_rule'):])
+        for rule_id in rule_ids[rule_ids.index(first):]:
+            rule = scanner.rules[rule_id]
+            if rule.skip_header and file_header:
+                continue
+            if rule_id != first and not rule.prog.match(lower):
+                continue
+            matches.setdefault(rule.name, []).append((i, line))
     return matches
 
-def find_todo_tags(root_path):
-    file_list = [f for f in Path(root_path).glob('**/*') if f.is_file()]
-    file_list = [f for f in file_list 
-        if not any(_part.startswith('.') for _part in f.parts)]
-    prog_todo = re.compile(r'\#+\s*(todo|to-do|fix-me|fixme)')
-    todo_dict = {}
-    for file in file_list:
-        todos = find_pattern(file, prog_todo)
-        if todos and len(todos)>0:
-            todo_dict[str(file)] = todos
-    return todo_dict
-
-def find_commented_code(root_path):
-    file_list = [f for f in Path(root_path).glob('**/*.py')]
-    file_list = [f for f in file_list 
-        if not any(_part.startswith('.') for _part in f.parts)]
-    prog_commented_code = re.compile(r'\#+\s+.*[\+|\-|\*|\/|\(|\=].*')
-    commented_code_dict = {}
-    for file in file_list:
-        commendted_code = find_pattern(file, prog_commented_code, True)
-        if commendted_code and len(commendted_code)>0:
-            commented_code_dict[str(file)] = commendted_code
-    return commented_code_dict
-
-def check_syntax(root_path, config):
-    todo_dict = find_todo_tags(root_path)
-    for path, lines in todo_dict.items():
-        for line in lines:
-            msg = f"{path}: L{line[0]} {line[1]} "
-            logging.error(f"Find Unresolved todo at {msg}")
+def scan_settings(config: dict):
+    return dict(DEFAULT_SETTINGS, **config.get('syntax_check', {}))
+
+def scan_files(inventory: Inventory, settings: dict):
+    """
+    Inventory entries to scan, leaving out hidden ones and the ones above
+    max_file_size. The folder_analysis exclude rules do not apply here.
+    """
+    max_file_size = settings["max_file_size"]
+    return [entry for entry in inventory.files() if not entry.hidden and
+        (max_file_size is None or entry.size <= max_file_size)]
 
-    commendted_code = find_commented_code(root_path)
-    ignore_special_lines = set(config['commented_code']['special_lines'])
-    for path, lines in commendted_code.items():
+def find_rules(inventory: Inventory, scanner: Scanner):
+    """
+    Scan every inventory file once, concurrently when workers > 1.
+    Return {rule name: {file path: [(line no, line)]}} in inventory order,
+    whatever order the files finish in.
+    """
+    entries = scan_files(inventory, scanner.settings)
+    return group_matches(scanner, [entry.path for entry in entries],
+                         scan_all(entries, scanner))
+
+def scan_all(entries: list, scanner: Scanner):
+    """The matches of every inventory entry, in order"""
+    file_list = [entry.path for entry in entries]
+    workers = scanner.settings["workers"] or os.cpu_count() or 1
+    if workers > 1 and len(file_list) > 1:
+        pool_class = futures.ProcessPoolExecutor \
+            if scanner.settings["executor"] == "process" \
+            else futures.ThreadPoolExecutor
+        with pool_class(max_workers=min(workers, len(file_list))) as pool:
+            # map yields in submission order, which keeps the log stable
+            file_matches = list(pool.map(
+                instrument.bind(scanner.scan_file), file_list, chunksize=16))
+    else:
+        file_matches = [scanner.scan_file(file) for file in file_list]
+    return file_matches
+
+def group_matches(scanner: Scanner, file_list: list, file_matches: list):
+    """Regroup per-file matches as {rule name: {file path: [(line no, line)]}}"""
+    results = {rule.name: {} for rule in scanner.rules}
+    for file, matches in zip(file_list, file_matches):
+        for name, lines in matches.items():
+            results[name][str(file)] = lines
+    return results
+
+def check_syntax(root_path, config, inventory: Inventory=None):
+    if inventory is None:
+        inventory = scan(root_path, config)
+    scanner = Scanner(load_rules(config), scan_settings(config))
+    log_matches(scanner, find_rules(inventory, scanner))
+
+def log_matches(scanner: Scanner, results: dict):
+    for rule in scanner.rules:
+        log_rule_matches(rule, results[rule.name])
+
+def log_rule_matches(rule: Rule, file_lines: dict):
+    """Log the {file path: [(line no, line)]} matches of one rule"""
+    log = getattr(logging, rule.level)
+    for path, lines in file_lines.items():
         for line in lines:
-            if line[1] in ignore_special_lines:
-                pass
-            else:
-                msg = f"{path}: L{line[0]} {line[1]} "
-                logging.warning(f"Find commented code at {msg}")
\ No newline at end of file
+            if line[1] in rule.ignore_lines:
+                continue
+            msg = f"{path}: L{line[0]} {line[1]} "
+            log(f"{rule.message} {msg}")
@@ -1,15 +1,16 @@
 import re
-from pathlib import Path
-from itertools import islice
-from functools import partial
-from treelib import tree
+from src.compact_tree import Tree
 import logging
 import src.utils as utils
+from src.markdown_tree import ReadmeDocument
+from src import instrument
 
 FIND_BRANCH = re.compile(r"\└──|\├──")
 FIND_TREE_ELE = re.compile((r"\└|\─|\├|\│"))
 MSG = "Please make sure to use '<-' to add description"
 class Node_data(object):
+    __slots__ = ('invalid', 'item', 'description')
+
     def __init__(self, text):
         self.invalid = False
         self.parse_text(text)
@@ -25,25 +26,11 @@ class Node_data(object):
             self.invalid = True
 
 
-def subtract_project_contents_section(readme_tree, readme_path):
+def subtract_project_contents_section(readme: ReadmeDocument):
     # Find the Project Contents section
-    for node in readme_tree.all_nodes():
-        if node.data.clean_text.lower() == "Project Contents".lower():
-            contents_root = node
-            break
-    if not contents_root:
+    contents = readme.section("Project Contents")
+    if contents is None:
         raise ValueError("Failed to find the project content tree in readme.")
-    line_numbers  = sorted([node.identifier for node in 
-        readme_tree.subtree(contents_root.identifier).all_nodes()])
-
-    start_line = min(line_numbers)
-    end_line = max(line_numbers)
-    
-    with open(readme_path, 'r') as f:
-        contents = f.readlines()
-
-    contents = [(i, contents[i-1]) for i in range(start_line, end_line+1,1)]
-
     return contents
 
 
@@ -58,13 +45,13 @@ def find_level(line):
     return level
 
 
-def parse(readme_tree, readme_path, show=False):
+def parse(readme: ReadmeDocument, show=False):
     """
-    Given a readme tree to subtract the project contents section and 
+    Given a readme document to subtract the project contents section and 
     convert it to a tree structure
     """
     max_level = 0
-    content_lines = subtract_project_contents_section(readme_tree, readme_path)
+    content_lines = subtract_project_contents_section(readme)
     contents = []
     for i, line in content_lines:
         level = find_level(line)
@@ -77,7 +64,7 @@ def parse(readme_tree, readme_path, show=False):
                 please follow the template's format""")
 
     # Build tree
-    dir_tree = tree.Tree()
+    dir_tree = Tree()
     root_line_no = contents[0][0]-1
     dir_tree.create_node('.', root_line_no)  # root node
  
@@ -112,26 +99,85 @@ def parse(readme_tree, readme_path, show=False):
 
     return dir_tree
 
+def path_parts(tag: str):
+    """Split a tag into path components, dropping empty and `.` parts like Path"""
+    return tuple(part for part in tag.split('/') if part not in ('', '.'))
+
+
+@instrument.timed("text_tree.tree_as_path_dict")
 def tree_as_path_dict(folder_tree):
+    """
+    Map the path of every leaf, as a tuple of components, to its identifier.
+    Paths are extended one tag at a time during a single depth-first walk.
+    """
     path_dict = {}
-    for path in folder_tree.paths_to_leaves():
-        key = Path(*[folder_tree.get_node(_id).tag for _id in path[1:]])
-        path_dict[key]=path[-1]
-
+    # Stack of (node index, path components of the node)
+    stack = [(0, ())]
+    while stack:
+        index, parts = stack.pop()
+        children = folder_tree.child_indexes(index)
+        if not children:
+            path_dict[parts] = folder_tree.identifier_of(index)
+            continue
+        for child in children:
+            stack.append((child, parts + path_parts(
+                folder_tree.strings[folder_tree.tag_ids[child]])))
     return path_dict
+
+
+def diff_paths(readme_paths: list, folder_paths: list,
+               directory_covers_subtree: bool=False):
+    """
+    Merge two sorted lists of (path components, value) pairs.
+    Return the folder entries missing from the readme and the readme
+    entries not in the folder. With directory_covers_subtree, a readme
+    path covers every folder path below it.
+    """
+    missing, extra = [], []
+    i = j = 0
+    while i < len(readme_paths) and j < len(folder_paths):
+        readme_path, folder_path = readme_paths[i][0], folder_paths[j][0]
+        if readme_path == folder_path:
+            i += 1
+            j += 1
+        elif directory_covers_subtree and \
+             folder_path[:len(readme_path)] == readme_path:
+            # Sorted order puts a directory right before its subtree
+            while j < len(folder_paths) and \
+                  folder_paths[j][0][:len(readme_path)] == readme_path:
+                j += 1
+            i += 1
+        elif readme_path < folder_path:
+            extra.append(readme_paths[i])
+            i += 1
+        else:
+            missing.append(folder_paths[j])
+            j += 1
+    extra.extend(readme_paths[i:])
+    missing.extend(folder_paths[j:])
+    return missing, extra
+
+
+def format_path(parts: tuple):
+    return '/'.join(parts) or '.'
         
 
-def check_project_content(readme_folder_tree, folder_tree):
+def check_project_content(readme_folder_tree, folder_tree,
+                          directory_covers_subtree: bool=False):
     readme_folder_path_dict = tree_as_path_dict(readme_folder_tree)
     folder_path_dict = tree_as_path_dict(folder_tree)
-    for path in folder_path_dict.keys():
-        if not readme_folder_path_dict.get(path, None):
-            logging.error(
-                f"Missing {path} in the Project contexts section. {MSG}"
-                )
-
-    for path, line_no in readme_folder_path_dict.items():
-        if not folder_path_dict.get(path, None):
-            logging.error(
-                f"Extra L{line_no}:{path} in the Project contexts section. {MSG}"
-                )
+    missing, extra = diff_paths(
+        sorted(readme_folder_path_dict.items()),
+        sorted(folder_path_dict.items()),
+        directory_covers_subtree)
+
+    for parts, _ in missing:
+        logging.error(
+            f"Missing {format_path(parts)} in the Project contexts section. {MSG}"
+            )
+
+    # Report in the readme order
+    for parts, line_no in sorted(extra, key=lambda item: item[1]):
+        logging.error(
+            f"Extra L{line_no}:{format_path(parts)} in the Project contexts section. {MSG}"
+            )
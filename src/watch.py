@@ -0,0 +1,437 @@
+import os
+import time
+import errno
+import ctypes
+import select
+import struct
+import logging
+from pathlib import Path
+from src import folder_tree, markdown_tree, text_tree, syntax_checker, utils
+from src import inventory, hash_cache
+from src.exclusions import ExclusionRules
+from src.log_capture import capture_records, replay
+
+# inotify(7) constants
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+WATCH_MASK = IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | \
+    IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF
+EVENT = struct.Struct('iIII')
+
+# Events are collected until nothing happens for this long, so an editor
+# saving several files (or one file in several writes) triggers one run
+QUIET_PERIOD = 0.05
+
+# The checks in the order their findings are shown
+CHECKS = ("empty_dirs", "holdover_items", "readme", "syntax", "project_contents")
+
+
+class InotifyWatcher(object):
+    """
+    Change events for a directory tree from inotify, through ctypes.
+    Every directory the inventory walk goes into gets a watch, including
+    the ones created later.
+    """
+    def __init__(self, root: Path, config: dict):
+        self.root = str(root)
+        self.rules = ExclusionRules.from_config(config)
+        self.libc = ctypes.CDLL(None, use_errno=True)
+        self.libc.inotify_add_watch.argtypes = [
+            ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        self.fd = self.libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.dirs = {}
+        self.overflow = False
+        try:
+            self.add_tree('.')
+        except OSError:
+            self.close()
+            raise
+
+    def add_tree(self, rel_dir: str):
+        """Watch a directory and the ones below it, return the paths found"""
+        paths = set()
+        for dir_path, dir_names, file_names in os.walk(
+                os.path.join(self.root, rel_dir)):
+            dir_names[:] = [name for name in dir_names
+                if not self.prunes(name, os.path.join(dir_path, name))]
+            wd = self.libc.inotify_add_watch(
+                self.fd, os.fsencode(dir_path), WATCH_MASK)
+            if wd < 0:
+                raise OSError(ctypes.get_errno(),
+                              f"Can not watch {dir_path} with inotify")
+            rel_path = os.path.relpath(dir_path, self.root)
+            self.dirs[wd] = rel_path
+            paths.add(rel_path)
+            paths.update(os.path.normpath(os.path.join(rel_path, name))
+                         for name in file_names)
+        return paths
+
+    def prunes(self, name: str, path: str):
+        """
+        Whether the inventory walk leaves a path out, by its own name only;
+        the events of the few other paths it leaves out are ignored later
+        """
+        return name.startswith('.') and self.rules.excludes(name, path)
+
+    def read_events(self):
+        changed = set()
+        try:
+            data = os.read(self.fd, 1 << 16)
+        except BlockingIOError:
+            return changed
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = EVENT.unpack_from(data, offset)
+            offset += EVENT.size
+            name = data[offset:offset + length].rstrip(b'\0')
+            offset += length
+            if mask & IN_Q_OVERFLOW:
+                self.overflow = True
+                continue
+            if mask & IN_IGNORED:
+                self.dirs.pop(wd, None)
+                continue
+            rel_dir = self.dirs.get(wd)
+            if rel_dir is None:
+                continue
+            if not name:
+                changed.add(rel_dir)
+                continue
+            name = os.fsdecode(name)
+            path = os.path.join(self.root, rel_dir, name)
+            if self.prunes(name, path):
+                continue
+            rel_path = os.path.normpath(os.path.join(rel_dir, name))
+            changed.add(rel_path)
+            if mask & IN_ISDIR and mask & (IN_CREATE | IN_MOVED_TO):
+                try:
+                    changed |= self.add_tree(rel_path)
+                except OSError as e:
+                    if e.errno != errno.ENOENT:
+                        raise
+        return changed
+
+    def changes(self, timeout: float=None):
+        """
+        Wait for changes and return the changed paths, relative to root.
+        None means the kernel dropped events and everything must be checked.
+        """
+        changed = set()
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        while ready:
+            changed |= self.read_events()
+            ready, _, _ = select.select([self.fd], [], [], QUIET_PERIOD)
+        if self.overflow:
+            self.overflow = False
+            return None
+        return changed
+
+    def close(self):
+        os.close(self.fd)
+
+
+class PollingWatcher(object):
+    """Change detection by comparing inventory snapshots, where inotify is missing"""
+    def __init__(self, root: Path, config: dict, interval: float=0.5):
+        self.root = root
+        self.config = config
+        self.interval = interval
+        self.snapshot = self.take()
+
+    def take(self):
+        return {entry.rel_path: ('dir',) if entry.is_dir else
+                (entry.size, entry.mtime_ns, entry.inode)
+                for entry in inventory.scan(self.root, self.config)}
+
+    def changes(self, timeout: float=None):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while deadline is None or time.monotonic() < deadline:
+            time.sleep(self.interval)
+            snapshot = self.take()
+            changed = {path for path in snapshot.keys() | self.snapshot.keys()
+                       if snapshot.get(path) != self.snapshot.get(path)}
+            self.snapshot = snapshot
+            if changed:
+                return changed
+        return set()
+
+    def close(self):
+        pass
+
+
+def open_watcher(root: Path, config: dict, interval: float=0.5):
+    try:
+        return InotifyWatcher(root, config)
+    except (OSError, AttributeError) as e:
+        print(f"Can not use inotify ({e}), polling every {interval}s instead")
+        return PollingWatcher(root, config, interval)
+
+
+class WatchSession(object):
+    """
+    The checks of one master checkout kept in memory between changes.
+    The template is parsed once. The master inventory and folder tree are
+    patched for the changed paths only, master file digests stay in a hash
+    cache and the syntax findings are kept per file, so a change only
+    re-reads the changed files. The README is only compared with the
+    template again when it changed.
+    """
+    def __init__(self, config: dict, master_root=Path("master"),
+                 template_root=Path("template"), template_fingerprint=None,
+                 level: int=-1):
+        self.config = config
+        self.master_root = Path(master_root)
+        self.level = level
+        self.cache = hash_cache.open_cache(config) or hash_cache.HashCache()
+        self.hash_options = folder_tree.HashOptions.from_config(config)
+        self.walker = inventory.Walker(config)
+        self.scanner = syntax_checker.Scanner(
+            syntax_checker.load_rules(config),
+            syntax_checker.scan_settings(config))
+        if template_fingerprint is not None:
+            self.template_tree = template_fingerprint.folder_tree()
+            self.template_readme = template_fingerprint.readme_lines()
+        else:
+            self.template_tree = folder_tree.parse(
+                Path(template_root), config, level=level)
+            self.template_readme = markdown_tree.TemplateLines.from_tree(
+                markdown_tree.parse(markdown_tree.ReadmeDocument.read(
+                    utils.get_readme_path(template_root))), config)
+        self.template_index = folder_tree.TreeIndex(self.template_tree)
+        self.inventory = None
+        self.entries = {}
+        self.tree = None
+        self.master_index = None
+        self.readme = None
+        self.records = {}
+        self.findings = {}
+
+    def run_check(self, name: str, func, *args):
+        with capture_records() as records:
+            try:
+                func(*args)
+            except Exception as e:
+                logging.exception(e)
+                logging.error(f"The {name} check failed")
+        self.findings[name] = records
+
+    def refresh(self, changed: set=None):
+        """
+        Re-run the checks affected by the changed paths (relative to
+        master), or every check when changed is None.
+        Return False if nothing had to run.
+        """
+        if changed is not None and not changed:
+            return False
+        self.cache.tick()
+        readme_path = utils.get_readme_path(self.master_root)
+        readme_rel_path = os.path.relpath(readme_path, self.master_root)
+        readme_changed = changed is None or readme_rel_path in changed
+
+        if changed is None or self.tree is None or not self.patch_tree(changed):
+            self.load_tree()
+        # README.md is a file of the tree too, so these run on any change;
+        # they only go over the patched nodes and the changed files again
+        self.run_check("empty_dirs", folder_tree.scan_empty_dirs, self.tree)
+        self.run_check("holdover_items", folder_tree.scan_holdover_items,
+            self.tree, self.template_tree, self.cache, self.hash_options,
+            None, self.master_index, self.template_index)
+        self.run_check("syntax", self.check_syntax, changed)
+        if readme_changed:
+            self.run_check("readme", self.check_readme, readme_path)
+        self.run_check("project_contents", lambda: text_tree.check_project_content(
+            text_tree.parse(self.readme), self.tree,
+            self.config['readme'].get('directory_covers_subtree', False)))
+        return True
+
+    def load_tree(self):
+        """Walk master and build its inventory and folder tree from scratch"""
+        self.inventory = inventory.scan(self.master_root, self.config)
+        self.tree = folder_tree.parse(self.master_root, self.config,
+            level=self.level, inventory=self.inventory)
+        self.master_index = folder_tree.TreeIndex(self.tree)
+        self.entries = {entry.rel_path: entry for entry in self.inventory}
+        self.entries['.'] = self.inventory.root_entry
+
+    def patch_tree(self, changed: set):
+        """
+        Update the inventory and the folder tree for the changed paths only.
+        Return False if they can not be patched and master must be walked
+        again: a .gitignore file changed, or master itself is gone.
+        """
+        if self.walker.use_gitignore and any(
+                os.path.basename(path) == '.gitignore' for path in changed):
+            return False
+        if not self.master_root.is_dir():
+            return False
+        # A path below a directory not seen before is handled by walking
+        # that directory
+        targets = {self.patch_target(path) for path in changed} - {'.'}
+        walked = set()
+        removed = set()
+        added = []
+        dirty = []
+        for rel_path in sorted(targets, key=lambda path: path.count(os.sep)):
+            if any(parent in walked for parent in parent_dirs(rel_path)):
+                continue
+            old = self.entries.get(rel_path)
+            new = self.walker.entry(self.master_root, rel_path,
+                self.entries[os.path.dirname(rel_path) or '.'])
+            if old is not None and new is not None and old.is_dir == new.is_dir:
+                # The tree shares the entry with the inventory
+                if not old.is_dir:
+                    old.size, old.mtime_ns, old.inode = \
+                        new.size, new.mtime_ns, new.inode
+                    node = self.master_index.nodes.get(rel_path)
+                    if node is not None:
+                        dirty.append(node.identifier)
+                continue
+            walked.add(rel_path)
+            if old is not None:
+                removed.add(rel_path)
+                if rel_path in self.master_index.nodes:
+                    dirty.append(self.master_index.remove(rel_path))
+            if new is not None:
+                entries = inventory.Inventory(self.master_root)
+                entries.add(new)
+                if new.is_dir:
+                    self.walker.walk(entries, new, rel_path,
+                        self.walker.dir_ignores(self.master_root, rel_path))
+                added.extend(entries)
+                for entry in entries:
+                    if entry.excluded:
+                        continue
+                    if self.level < 0 or entry.depth <= self.level:
+                        dirty.append(self.master_index.add(entry))
+
+        for entry in self.inventory.replace(removed, added):
+            del self.entries[entry.rel_path]
+        self.entries.update((entry.rel_path, entry) for entry in added)
+        self.mark_keep_markers(
+            {os.path.dirname(path) or '.' for path in walked})
+        self.master_index.update(dirty)
+        return True
+
+    def patch_target(self, rel_path: str):
+        """The changed path, or its first parent directory not seen before"""
+        target = ''
+        for name in os.path.normpath(rel_path).split(os.sep):
+            target = os.path.join(target, name)
+            if target not in self.entries:
+                break
+        return target
+
+    def mark_keep_markers(self, rel_dirs: set):
+        """Roll the keep markers up again from these directories to master"""
+        for rel_dir in set(rel_dirs):
+            rel_dirs.update(parent_dirs(rel_dir))
+        keep_markers = self.walker.keep_markers
+        for rel_dir in sorted(rel_dirs, key=lambda path: len(parent_dirs(path)),
+                              reverse=True):
+            dir_entry = self.entries[rel_dir]
+            try:
+                names = os.listdir(dir_entry.path)
+            except OSError:
+                names = []
+            prefix = '' if rel_dir == '.' else rel_dir
+            dir_entry.has_keep_marker = not dir_entry.excluded and any(
+                name in keep_markers or getattr(self.entries.get(
+                    os.path.join(prefix, name)), 'has_keep_marker', False)
+                for name in names)
+
+    def check_readme(self, readme_path):
+        self.readme = markdown_tree.ReadmeDocument.read(readme_path)
+        markdown_tree.check_readme(markdown_tree.parse(self.readme),
+            self.template_readme, self.config)
+
+    def check_syntax(self, changed: set=None):
+        """
+        Scan the changed and new files only. The records logged for every
+        file are kept and replayed, so unchanged files cost no logging.
+        """
+        entries = syntax_checker.scan_files(
+            self.inventory, self.scanner.settings)
+        if changed is None:
+            # Events were dropped, no kept finding can be trusted
+            self.records = {}
+        else:
+            for rel_path in changed:
+                self.records.pop(
+                    os.path.join(str(self.master_root), rel_path), None)
+        pending = [entry for entry in entries if entry.path not in self.records]
+        for entry, matches in zip(
+                pending, syntax_checker.scan_all(pending, self.scanner)):
+            self.records[entry.path] = self.match_records(entry.path, matches)
+        self.records = {entry.path: self.records[entry.path]
+                        for entry in entries}
+        # Logged rule by rule, then in inventory order, like log_matches
+        for rule in self.scanner.rules:
+            for records in self.records.values():
+                replay(records.get(rule.name, ()))
+
+    def match_records(self, path: str, matches: dict):
+        """The records logged for the matches of one file, by rule name"""
+        records = {}
+        for rule in self.scanner.rules:
+            if rule.name in matches:
+                with capture_records() as records[rule.name]:
+                    syntax_checker.log_rule_matches(
+                        rule, {path: matches[rule.name]})
+        return records
+
+    def report(self, elapsed: float):
+        formatter = logging.Formatter(logging.BASIC_FORMAT)
+        print(f"--- {time.strftime('%H:%M:%S')} checked in "
+              f"{elapsed * 1000:.0f} ms ---")
+        records = [record for name in CHECKS
+                   for record in self.findings.get(name, [])]
+        for record in records:
+            print(formatter.format(record))
+        if not records:
+            print("No findings, the pre-release check passes")
+
+    def close(self):
+        self.cache.close()
+
+
+def parent_dirs(rel_path: str):
+    """The directories above a relative path, up to '.'"""
+    parents = []
+    while rel_path not in ('', '.'):
+        rel_path = os.path.dirname(rel_path) or '.'
+        parents.append(rel_path)
+    return parents
+
+
+def watch(config: dict, master_root=Path("master"), template_root=Path("template"),
+          template_fingerprint=None, level: int=-1, interval: float=0.5):
+    """Check master, then check again on every change until interrupted"""
+    session = WatchSession(config, master_root, template_root,
+                           template_fingerprint, level)
+    watcher = open_watcher(Path(master_root), config, interval)
+    print(f"Watching {master_root}, press Ctrl+C to stop")
+    try:
+        changed = None
+        while True:
+            start = time.perf_counter()
+            if session.refresh(changed):
+                session.report(time.perf_counter() - start)
+            changed = watcher.changes()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        watcher.close()
+        session.close()